@@ -25,6 +25,7 @@ in the podcast feed."""
 
 # standard library imports
 from __future__ import print_function, unicode_literals
+from collections import deque
 import logging
 from optparse import OptionParser
 try:
@@ -33,7 +34,7 @@ except NameError:
     pass
 
 # Other pypod modules
-from pypod.lib.db import get_all_pc_episodes, get_selected_podcasts, \
+from pypod.lib.db import get_selected_podcasts, iter_all_pc_episodes, \
                            update_episode
 from pypod.lib.datatypes import EpisodeStatus
 from pypod.lib.utils import generic_id_help, mutex
@@ -67,12 +68,14 @@ downloading such episodes.  You can specify the value for NUM with -n.
 def _catchup_podcast( gdbh, n, pc):
     "catchup one podcast"
     _i( " * Podcast {0.castid}: {0.castname}".format( pc))
-    eps = get_all_pc_episodes( gdbh, pc)
-    if n > 0:
-        eps_to_process = eps[:-n]
-    else:
-        eps_to_process = eps
-    for ep in eps_to_process:
+    # An episode is processed once n more recent ones have been read, so
+    # that only n episodes are held at a time
+    recent = deque()
+    for ep in iter_all_pc_episodes( gdbh, pc):
+        recent.append( ep)
+        if len( recent) <= n:
+            continue
+        ep = recent.popleft()
         if ep.epstatus == EpisodeStatus.Pending or \
            ep.epstatus == EpisodeStatus.Error:
             _d( (pc.castid, ep.episodeid, str(ep.epstatus) + " -> Skipped"))
@@ -28,21 +28,32 @@ import logging
 from optparse import OptionParser
 import os
 import os.path
-import shutil
 import subprocess
 import time
 import traceback
+from urlparse import urlparse
 try:
     str = unicode
 except NameError:
     pass
 
 # Other pypod modules
-from pypod.lib.config import get_encl_tmp, get_option
-from pypod.lib.db import get_selected_podcasts, get_all_pc_episodes, update_episode
+from pypod.lib.config import get_bool_option, get_encl_tmp, get_max_threads, \
+                              get_option, get_progress_interval
+from pypod.lib.db import add_download, get_selected_podcasts, \
+                         get_pristine_downloads, iter_pending_episodes, \
+                         update_episode
 from pypod.lib.datatypes import EpisodeStatus, PCEnabled
-from pypod.lib.url_getter import easy_get
-from pypod.lib.utils import generic_id_help, mutex, sanitize_filename
+from pypod.lib.progress import ProgressMeter, Transfer
+from pypod.lib.schedule import Budget, add_schedule_options, \
+                               order_episodes, parse_duration, parse_size
+from pypod.lib import stats
+from pypod.lib.throttle import get_limiter
+from pypod.lib.url_getter import easy_get, staging_names
+from pypod.lib.utils import claim_name, copy_file, generic_id_help, \
+                            link_or_clone, mutex, place_file, \
+                            sanitize_filename
+from pypod.lib.workers import WorkerPool, completed
 
 
 __author__    = "Robert N. Evans <http://home.earthlink.net/~n1be/>"
@@ -66,7 +77,7 @@ def _w( msg):
     logging.warning( "d/l: " + str( msg))
 
 
-_usage_text = "Usage: %prog download [<castid>...]"
+_usage_text = "Usage: %prog download [options] [<castid>...]"
 _helptext = _usage_text + """
 
 The download command will cause %prog to download any podcast
@@ -74,6 +85,11 @@ episodes that are marked Pending.  Such episodes are usually generated
 by a prior call to "%prog update".  If you want to combine an update
 with a download, as is normally the case, you may want "%prog fetch".
 
+Episodes are downloaded in the order set by the downloadorder option:
+feed (podcast by podcast, oldest first), newest, smallest or roundrobin.
+With a time or byte budget, no transfer is started that is not expected
+to fit in what is left of it; such episodes stay Pending for a later run.
+
 """ + generic_id_help( "podcast")
 
 
@@ -96,31 +112,102 @@ def _handle_episode_error( ep, gcp, gdbh):
     gdbh.commit()
 
 
-def _download_episode( ep, gcp, gdbh):
-    "Download one pending episode"
-    _i( "{0.podcast.castid}.{0.episodeid} {0.title}".format( ep))
-    ep.eplastattempt = int( time.time())
-    ep.epfirstattempt = ep.epfirstattempt or ep.eplastattempt
-    uri = ep.epurl # urllib.quote( ep.epurl, ':/')
-    filename, path, content_type = easy_get( get_encl_tmp(), uri)
-    if not path:
-        return _handle_episode_error( ep, gcp, gdbh)
-    _d( " . {0} episode {1} downloaded".format( content_type, path))
-    vars = dict( # These values may be interpolated into config options;
-                 # NOTE: config_parser requires these values to be strings:
-                 castid="{0.podcast.castid:03d}".format( ep),
+def _config_vars( ep, filename):
+    "Values that may be interpolated into the config options of an episode"
+    # NOTE: config_parser requires these values to be strings:
+    return dict( castid="{0.podcast.castid:03d}".format( ep),
                  epid="{0.episodeid:04d}".format( ep),
                  safecasttitle=sanitize_filename( ep.podcast.castname),
                  safeeptitle=sanitize_filename( ep.title),
                  safefilename=sanitize_filename( filename) )
+
+
+_staging_subdir = ".enclosurexfer"
+
+def _staging_dir( ep, gcp):
+    """Return the directory to download an episode into.  That is the
+    enclosurexfer directory, unless it is on another filesystem than the
+    episode's downloaddir; then a hidden directory within downloaddir is
+    used instead, so that placing the finished file is a rename, not a
+    copy.  Runs on the main thread, before the download is queued."""
+    encl = get_encl_tmp()
+    dldir = get_option( gcp, ep.podcast.castid, "downloaddir",
+                        vars=_config_vars( ep, "")).strip()
+    try:
+        os.path.isdir( dldir) or os.makedirs( dldir)
+        if os.stat( dldir).st_dev == os.stat( encl).st_dev:
+            return encl
+        staging = os.path.join( dldir, _staging_subdir)
+        os.path.isdir( staging) or os.makedirs( staging)
+    except OSError as e:
+        _d( "Staging in {0}: {1}".format( encl, e))
+        return encl
+    return staging
+
+
+def _command_env( ep, filename):
+    "Environment for the external commands run on a downloaded file"
+    env = dict( os.environ)
+    env[ "CASTID"] = str( ep.podcast.castid)
+    env[ "CASTTITLE"] = ep.podcast.castname.encode( 'utf-8')
+    env[ "EPFILENAME"] = filename
+    env[ "EPID"] = str( ep.episodeid)
+    env[ "EPTITLE"] = ep.title.encode( 'utf-8')
+    env[ "EPURL"] = ep.epurl
+    env[ "FEEDURL"] = ep.podcast.feedurl
+    env[ "SAFECASTTITLE"] = sanitize_filename( ep.podcast.castname)
+    env[ "SAFEEPTITLE"] = sanitize_filename( ep.title)
+    return env
+
+
+def _get_type_command( ep, gcp, path):
+    """Run gettypecommand on a downloaded file; return its output, or None
+    if it fails"""
+    cmd = get_option( gcp, ep.podcast.castid, "gettypecommand").strip()
+    if not cmd:
+        return None
+    _d( "Get type cmd: {0}".format( cmd))
+    try:
+        p = subprocess.Popen( args=cmd, close_fds=True, shell=True,
+                              env=_command_env( ep, path),
+                              stdout=subprocess.PIPE)
+    except OSError as e:
+        _w( "gettypecommand: {0}".format( e))
+        return None
+    out = p.communicate()[0]
+    _d( "Get type cmd exited with {0}: {1!r}".format( p.returncode, out))
+    if p.returncode:
+        return None
+    return out.decode( 'utf-8', 'replace').strip()
+
+
+def _content_type( ep, gcp, path, sniffed, http_type):
+    """Decide the content type of a downloaded file.  The type found by
+    sniffing its first bytes is the authority; only if the file was not
+    recognized is gettypecommand run.  After that the Content-Type sent by
+    the server and then the type given in the feed are used.  Only the media
+    type is kept, without parameters such as charset, and the generic
+    application/octet-stream is passed over."""
+    if sniffed:
+        return sniffed
+    candidates = [ lambda: _get_type_command( ep, gcp, path),
+                   lambda: http_type, lambda: ep.enctype]
+    for get in candidates:
+        type = ( get() or "").partition( ";")[0].strip()
+        if type and type != "application/octet-stream":
+            return type
+    return ep.enctype.strip()
+
+
+def _final_name( ep, gcp, filename, content_type):
+    """Return the name to store an episode under: downloaddir/namingpatt,
+    with the suffix that renametypes gives for its content type"""
+    vars = _config_vars( ep, filename)
     newfn = (get_option( gcp, ep.podcast.castid,
                          "downloaddir", vars=vars).strip()
              + os.sep +
              get_option( gcp, ep.podcast.castid,
                          "namingpatt", vars=vars).strip())
-    # Could use gettypecommand here as the authority on file content type
-    if not content_type.strip():
-        content_type = ep.enctype.strip()
     # Rename the file to agree with content_type
     for rt in get_option( gcp, ep.podcast.castid, "renametypes").split(","):
         type, sep, suffix = rt.partition( ":")
@@ -128,64 +215,325 @@ def _download_episode( ep, gcp, gdbh):
             if not newfn.endswith( suffix):
                 newfn += suffix
             break
-    # Move file to final location
-    dir = os.path.dirname( newfn)
-    os.path.isdir( dir) or os.makedirs( dir)
-    shutil.move( path, newfn)
-    # Execute post-process command
-    env = os.environ
-    env[ "CASTID"] = str( ep.podcast.castid)
-    env[ "CASTTITLE"] = ep.podcast.castname.encode( 'utf-8')
-    env[ "EPFILENAME"] = newfn
-    env[ "EPID"] = str( ep.episodeid)
-    env[ "EPTITLE"] = ep.title.encode( 'utf-8')
-    env[ "EPURL"] = ep.epurl
-    env[ "FEEDURL"] = ep.podcast.feedurl
-    env[ "SAFECASTTITLE"] = sanitize_filename( ep.podcast.castname)
-    env[ "SAFEEPTITLE"] = sanitize_filename( ep.title)
+    return newfn
+
+
+_deferred = "deferred"   # Result of a download held back by the budget
+
+def _download_episode( ep, gcp, staging, meter, limiters, budget):
+    """Download one pending episode into the staging directory and move it
+    to its final location.  This runs on a worker thread, so it must not touch
+    the database.  Returns ( file name, content type, name on the server,
+    SHA-256 digest) if the episode was stored, or _deferred if the budget
+    does not allow the transfer."""
+    if budget and not budget.admit( ep.eplength):
+        return _deferred
+    with stats.podcast( ep.podcast.castid):
+        _i( "{0.podcast.castid}.{0.episodeid} {0.title}".format( ep))
+        ep.eplastattempt = int( time.time())
+        ep.epfirstattempt = ep.epfirstattempt or ep.eplastattempt
+        uri = ep.epurl # urllib.quote( ep.epurl, ':/')
+        fsync = get_bool_option( gcp, ep.podcast.castid, "syncdownloads")
+        progress = Transfer( "{0.podcast.castid}.{0.episodeid}".format( ep),
+                             ep.eplength or None)
+        meter.add( progress)
+        try:
+            filename, path, http_type, sniffed, digest = easy_get(
+                staging, uri, fsync=fsync,
+                prealloc=get_bool_option( gcp, ep.podcast.castid,
+                                          "preallocate"),
+                progress=progress, limiters=limiters)
+        finally:
+            meter.remove( progress)
+            if budget:
+                budget.settle( ep.eplength, progress.received)
+        if not path:
+            return None
+        _d( " . {0} episode {1} downloaded".format( http_type, path))
+        content_type = _content_type( ep, gcp, path, sniffed, http_type)
+        newfn = _final_name( ep, gcp, filename, content_type)
+        # Move file to final location, without replacing an existing file
+        with stats.timed( "move"):
+            newfn = place_file( path, newfn, fsync=fsync)
+        return newfn, content_type, filename, digest
+
+
+def _wants_postprocess( ep, gcp, content_type):
+    """Tell whether the post-process command applies to a downloaded file of
+    the given content type, according to postproctypes.  The special type
+    ALL selects every file."""
+    castid = ep.podcast.castid
+    if not get_option( gcp, castid, "postproccommand").strip():
+        return False
+    types = [ t.strip() for t in
+              get_option( gcp, castid, "postproctypes").split( ",")]
+    return "ALL" in types or content_type in types
+
+
+def _postprocess( ep, gcp, newfn):
+    """Run the post-process command on a downloaded file, on a worker thread.
+    Each run gets its own environment.  Returns the command's exit status."""
+    env = _command_env( ep, newfn)
     cmd = get_option( gcp, ep.podcast.castid, "postproccommand").strip()
-    if cmd:
-        _d( "Postprocess cmd: {0}\n ENV: {1}".format( cmd, env))
+    _d( "Postprocess cmd: {0}\n ENV: {1}".format( cmd, env))
+    with stats.podcast( ep.podcast.castid), stats.timed( "postprocess"):
         p = subprocess.Popen(args=cmd, close_fds=True, shell=True, env=env)
         _d( "Postprocess cmd started")
         p.wait()
-        _d( "Postprocess cmd done, returncode={0}".format( p.returncode))
-        if p.returncode:
-            _w( "Post-Process command exit status: {0}".format( p.returncode))
-    # Update episode status
+    _d( "Postprocess cmd done, returncode={0}".format( p.returncode))
+    return p.returncode
+
+
+def _record_download( ep, gcp, gdbh, newfn, basename, content_type, digest,
+                      pristine):
+    """Update the status of a downloaded episode and record where it is.
+    If that fails, the episode is left Pending, in the DB and in ep."""
     ep.epstatus = EpisodeStatus.Downloaded
-    update_episode( gdbh, ep)
-    gdbh.commit()
+    try:
+        with stats.podcast( ep.podcast.castid), stats.timed( "record"):
+            update_episode( gdbh, ep)
+            add_download( gdbh, ep, newfn, basename, content_type, digest,
+                          pristine)
+            gdbh.commit()
+    except:
+        gdbh.rollback()
+        ep.epstatus = EpisodeStatus.Pending
+        raise
+
+
+def _unchanged_download( rows):
+    """Return the first of some rows of the downloads table whose file is
+    still on disk as it was recorded, or None"""
+    for row in rows:
+        try:
+            st = os.stat( row[ "filename"])
+        except OSError:
+            continue
+        if st.st_size == row[ "length"] and \
+           int( st.st_mtime) == row[ "mtime"]:
+            return row
+    return None
+
+
+def _dedupe_content( ep, gdbh, newfn, digest, pristine):
+    """Make a new download share the disk blocks of an identical file that
+    is already stored, such as the same media from another URL.  The other
+    file must be pristine; a hard link is only used if the new one will stay
+    pristine too."""
+    rows = [ row for row in get_pristine_downloads( gdbh, sha256=digest)
+             if ( row[ "castid"], row[ "episodeid"]) !=
+                ( ep.podcast.castid, ep.episodeid)]
+    row = _unchanged_download( rows)
+    if not row or os.path.samefile( row[ "filename"], newfn):
+        return
+    partial = newfn + ".partial"
+    try:
+        if os.path.exists( partial):
+            os.remove( partial)     # Left by a run that died
+        how = link_or_clone( row[ "filename"], partial, hardlink=pristine)
+        if how:
+            os.rename( partial, newfn)
+    except ( IOError, OSError) as e:
+        # The download is fine as it is, only not sharing disk blocks
+        _w( "{0.podcast.castid}.{0.episodeid}: {1}".format( ep, e))
+        return
+    if how:
+        _i( "{0.podcast.castid}.{0.episodeid}: same content as {1}, now"
+            " a {2}".format( ep, row[ "filename"], how))
+
+
+def _store_copy( ep, gcp, gdbh, pp_pool, source, basename, content_type,
+                 digest, source_pristine):
+    """Store an episode as a copy of file source, another podcast's download
+    of the same enclosure, instead of fetching it again.  The copy shares the
+    disk blocks of source where the filesystem allows it."""
+    _i( "{0.podcast.castid}.{0.episodeid} {0.title}".format( ep))
+    ep.eplastattempt = int( time.time())
+    ep.epfirstattempt = ep.epfirstattempt or ep.eplastattempt
+    pristine = not _wants_postprocess( ep, gcp, content_type)
+    newfn = _final_name( ep, gcp, basename, content_type)
+    dir = os.path.dirname( newfn)
+    partial = newfn + ".partial"
+    try:
+        with stats.podcast( ep.podcast.castid), stats.timed( "copy"):
+            os.path.isdir( dir) or os.makedirs( dir)
+            if os.path.exists( partial):
+                os.remove( partial)     # Left by a run that died
+            how = link_or_clone( source, partial,
+                                 hardlink=pristine and source_pristine)
+            if not how:
+                copy_file( source, partial)
+                how = "copy"
+            newfn = claim_name( partial, newfn)
+        _d( " . {0} of {1}".format( how, source))
+        _record_download( ep, gcp, gdbh, newfn, basename, content_type,
+                          digest, pristine)
+    except ( IOError, OSError) as e:
+        _w( "{0.podcast.castid}.{0.episodeid}: {1}".format( ep, e))
+        _handle_episode_error( ep, gcp, gdbh)
+        return
+    if not pristine:
+        pp_pool.submit( _postprocess, ( ep, gcp, newfn), tag=ep)
+
+
+def _cleanup_directory( gdbh, dirs):
+    """Remove files from the enclosure staging directories that do not
+    belong to a pending episode, such as partial downloads of episodes that
+    have since been skipped or removed.  Partial downloads of episodes that
+    are still pending are kept so that they can be resumed."""
+    keep = set()
+    for ep in iter_pending_episodes( gdbh, enabled_only=False):
+        keep.update( staging_names( ep.epurl))
+    for base in dirs:
+        for name in os.listdir( base):
+            path = os.path.join( base, name)
+            if name not in keep and os.path.isfile( path):
+                _d( "Removing stale file {0}".format( path))
+                os.remove( path)
+
+
+def _job_limits( ep, gcp):
+    """Concurrency limits for downloading one episode: the maxthreads value
+    of its podcast section and maxhostthreads for the enclosure's host.
+    A value of 0 or less sets no limit."""
+    castid = ep.podcast.castid
+    host = urlparse( ep.epurl).netloc.lower()
+    limits = [ ( ( "castid", castid), get_max_threads( gcp, castid)),
+               ( ( "host", host),
+                 int( get_option( gcp, castid, "maxhostthreads")))]
+    return [ ( key, limit) for key, limit in limits if limit > 0]
+
+
+def _make_budget( parser, options, meter):
+    "Return a Budget for the budget options, or None if none were given"
+    try:
+        seconds = options.time_budget and parse_duration( options.time_budget)
+        nbytes = options.byte_budget and parse_size( options.byte_budget)
+    except ValueError as e:
+        parser.error( str( e))
+    if options.time_budget is None and options.byte_budget is None:
+        return None
+    return Budget( seconds, nbytes, received=lambda: meter.received)
 
 
 def _download_worker( args, gcp, gdbh):
     "Download pending episodes from enabled feeds"
     parser = OptionParser( usage=_helptext)
+    add_schedule_options( parser)
     (options, args) = parser.parse_args( args=args)
     podcasts = filter( lambda pc: pc.is_enabled,
                        get_selected_podcasts( gdbh, args))
-    episodes = []
-    for pc in podcasts:
-        episodes.extend(
-            filter( lambda e: e.epstatus == EpisodeStatus.Pending,
-                    get_all_pc_episodes( gdbh, pc)))
+    episodes = list( iter_pending_episodes( gdbh, podcasts))
     _i( "{0} episode(s) to consider from {1} podcast(s)".format(
             len( episodes), len( podcasts)))
+    try:
+        episodes = order_episodes( episodes, options.order or
+                                   get_option( gcp, "general", "downloadorder"))
+    except ValueError as e:
+        parser.error( str( e))
+    # Transfers run on the pool threads and hand finished files on to the
+    # post-process pool, so that slow commands do not idle the network.
+    # This thread is the only DB writer.
+    pool = WorkerPool( get_max_threads( gcp))
+    pp_pool = WorkerPool( int( get_option( gcp, "general", "postprocthreads")),
+                          results=pool.results)
+    pp_failed = 0
+    meter = ProgressMeter( get_progress_interval( gcp))
+    budget = _make_budget( parser, options, meter)
+    deferred = []
+    # The maxrate of [general] is shared by all transfers, the maxrate of a
+    # podcast section by the transfers of that podcast
+    limiter = get_limiter( gcp, "general", "maxrate")
+    pc_limiters = {}
+    staging_dirs = set( [ get_encl_tmp()])
+    # Episodes that share an enclosure URL are downloaded once, by the first
+    # of them; the others wait here and then get a copy
+    sharing = {}
     for ep in episodes:
-        try:
-            _download_episode( ep, gcp, gdbh)
-        except KeyboardInterrupt:
-            _i( "Interrupted by Ctrl-C")
-            return
-        except:
-            # Print error and try next episode
-            traceback.print_exc()
+        if ep.epurl in sharing:
+            sharing[ ep.epurl].append( ep)
+            continue
+        row = _unchanged_download( get_pristine_downloads(
+                  gdbh, epurl=ep.epurl, castid=ep.podcast.castid))
+        if row:
+            _store_copy( ep, gcp, gdbh, pp_pool, row[ "filename"],
+                         row[ "basename"], row[ "mediatype"], row[ "sha256"],
+                         True)
             continue
+        sharing[ ep.epurl] = []
+        castid = ep.podcast.castid
+        if castid not in pc_limiters:
+            pc_limiters[ castid] = get_limiter( gcp, castid, "maxrate")
+        limiters = filter( None, [ limiter, pc_limiters[ castid]])
+        staging = _staging_dir( ep, gcp)
+        staging_dirs.add( staging)
+        pool.submit( _download_episode,
+                     ( ep, gcp, staging, meter, limiters, budget),
+                     limits=_job_limits( ep, gcp), tag=ep)
+    meter.start()
+    try:
+        for job, result, exc in completed( pool, pp_pool):
+            ep = job.tag
+            meter.clear()
+            try:
+                if exc:
+                    # Print error and go on with the other episodes
+                    traceback.print_exception( *exc)
+                elif job.func == _postprocess:
+                    if result:
+                        _w( "{0.podcast.castid}.{0.episodeid}: Post-Process"
+                            " command exit status: {1}".format( ep, result))
+                        pp_failed += 1
+                elif result == _deferred:
+                    deferred.append( ep)
+                    deferred.extend( sharing.pop( ep.epurl, []))
+                elif result:
+                    newfn, content_type, basename, digest = result
+                    pristine = not _wants_postprocess( ep, gcp, content_type)
+                    _dedupe_content( ep, gdbh, newfn, digest, pristine)
+                    _record_download( ep, gcp, gdbh, newfn, basename,
+                                      content_type, digest, pristine)
+                    # Copy before post-processing changes the file
+                    for other in sharing.pop( ep.epurl, []):
+                        _store_copy( other, gcp, gdbh, pp_pool, newfn,
+                                     basename, content_type, digest, pristine)
+                    if not pristine:
+                        pp_pool.submit( _postprocess, ( ep, gcp, newfn),
+                                        tag=ep)
+                else:
+                    _handle_episode_error( ep, gcp, gdbh)
+                    for other in sharing.pop( ep.epurl, []):
+                        _d( "{0.podcast.castid}.{0.episodeid}: not tried,"
+                            " same URL as {1.podcast.castid}.{1.episodeid}"
+                            .format( other, ep))
+            except Exception:
+                # Storing or recording this episode failed; go on with the
+                # other episodes
+                traceback.print_exc()
+    except KeyboardInterrupt:
+        pool.shutdown()
+        pp_pool.shutdown()
+        meter.stop()
+        _i( "Interrupted by Ctrl-C")
+        return
+    pool.close()
+    pp_pool.close()
+    pool.join()
+    pp_pool.join()
+    meter.stop()
+    if pp_failed:
+        _w( "{0} post-process command(s) failed".format( pp_failed))
+    if deferred:
+        _w( "{0} episode(s) deferred, not expected to fit the budget:"
+            .format( len( deferred)))
+        for ep in deferred:
+            _w( "   {0.podcast.castid}.{0.episodeid} {0.title}".format( ep))
+    _cleanup_directory( gdbh, staging_dirs)
 
 
 def _cmd_worker( args, gcp, gdbh):
     "Hold database mutex while running the download command"
-    with mutex():
+    with mutex(), stats.timed( "download"):
         _download_worker( args, gcp, gdbh)
 
 
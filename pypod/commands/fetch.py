@@ -32,6 +32,7 @@ except NameError:
 
 # Other pypod modules
 from pypod.lib.config import get_option
+from pypod.lib.schedule import add_schedule_options, schedule_args
 from pypod.lib.utils import generic_id_help
 
 
@@ -42,13 +43,14 @@ __license__   = "GPLv3"
 __version__   = "0.2"
 
 
-_usage_text = "Usage: %prog fetch [<castid>...]"
+_usage_text = "Usage: %prog fetch [options] [<castid>...]"
 _helptext = _usage_text + """
 
 The fetch command will cause %prog to scan all feeds (as with
 "%prog update") and then download all new episodes (as with
 "%prog download").  Fetch is the default %prog command; fetch
-will be executed if %prog is run with no arguments.
+will be executed if %prog is run with no arguments.  The --due-only
+option is passed on to update, the others to download.
 
 """ + generic_id_help( "podcast")
 
@@ -56,13 +58,19 @@ will be executed if %prog is run with no arguments.
 def _fetch_worker( args, gcp, gdbh):
     "Scan feeds, then download new episodes"
     parser = OptionParser( usage=_helptext)
+    parser.add_option( "--due-only", dest="due_only", action="store_true",
+                       default=False,
+                       help="Only update the podcasts that are due")
+    add_schedule_options( parser)
     (options, args) = parser.parse_args( args=args)
 
     # Instead of doing a fetch, show the introduction if never seen already...
     showintro = get_option( gcp, "general", "showintro").lower()
     if showintro.count( "no") + showintro.count( "false"):
-        _cmd_dict[ "update"]( args=args, gcp=gcp, gdbh=gdbh)
-        _cmd_dict[ "download"]( args=args, gcp=gcp, gdbh=gdbh)
+        update_args = [ "--due-only"] if options.due_only else []
+        _cmd_dict[ "update"]( args=update_args + args, gcp=gcp, gdbh=gdbh)
+        _cmd_dict[ "download"]( args=schedule_args( options) + args,
+                                gcp=gcp, gdbh=gdbh)
     else:
         _cmd_dict[ "setup"]( args=args, gcp=gcp, gdbh=gdbh)
 
@@ -32,7 +32,7 @@ except NameError:
     pass
 
 # Other pypod modules
-from pypod.lib.db import get_all_pc_episodes, get_selected_podcasts
+from pypod.lib.db import iter_all_pc_episodes, iter_selected_podcasts
 from pypod.lib.utils import generic_id_help, pru
 
 __author__    = "Robert N. Evans <http://home.earthlink.net/~n1be/>"
@@ -64,7 +64,7 @@ def _lscasts_worker( args, gcp, gdbh):
         print( url_fmt.format( "URL and other properties"))
     print( pc_fmt.format( "----", "----", "----",
                           "----------------------------------------"))
-    for pc in get_selected_podcasts( gdbh, args):
+    for pc in iter_selected_podcasts( gdbh, args):
         pend = gdbh.execute("""SELECT COUNT(*) FROM episodes
                                  WHERE castid = ? AND status = 'Pending'""",
                             ( pc.castid, )).fetchone()[0]
@@ -76,6 +76,7 @@ def _lscasts_worker( args, gcp, gdbh):
             mbrs = "updated: {0.updated}, fails: {0.failedattempts}"
             if pc.failedattempts:
                 mbrs += ", last_try: {0.last_try}"
+            mbrs += ", next: {0.due}"
             print( url_fmt.format( pc.feedurl))
             print( url_fmt.format( mbrs.format( pc)))
 
@@ -102,8 +103,8 @@ def _lsepisodes_worker( args, gcp, gdbh):
         print( url_fmt.format( "Episode URL and other properties"))
     print( ep_fmt.format( "----", "----", "----",
          "----------------------------------------------------------------------"))
-    for pc in get_selected_podcasts( gdbh, args):
-        for ep in get_all_pc_episodes( gdbh, pc):
+    for pc in iter_selected_podcasts( gdbh, args):
+        for ep in iter_all_pc_episodes( gdbh, pc):
             pru( ep_fmt.format( ep.podcast.castid, ep.episodeid, ep.epstatus,
                                 ep.title))
             if options.islong:
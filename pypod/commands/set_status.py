@@ -32,7 +32,7 @@ except NameError:
     pass
 
 # Other pypod modules
-from pypod.lib.db import get_selected_podcasts, get_selected_pc_episodes, \
+from pypod.lib.db import get_selected_podcasts, iter_selected_pc_episodes, \
                            update_episode
 from pypod.lib.datatypes import EpisodeStatus, string_to_enum
 from pypod.lib.utils import exe_name, mutex
@@ -104,13 +104,14 @@ def _setstatus_worker( gdbh, castid, new_status, args):
         if len( podcastlist) < 1:
             _w( "--castid did not give a valid podcast id")
         else:
-            eplist = get_selected_pc_episodes( gdbh, podcastlist[0], args)
-            _d( "Modifying {0} episodes".format( len( eplist)))
-            if len( eplist):
-                for ep in eplist:
-                    ep.epstatus = new_status
-                    ep.epfailedattempts = 0
-                    update_episode( gdbh, ep)
+            n = 0
+            for ep in iter_selected_pc_episodes( gdbh, podcastlist[0], args):
+                ep.epstatus = new_status
+                ep.epfailedattempts = 0
+                update_episode( gdbh, ep)
+                n += 1
+            _d( "Modified {0} episodes".format( n))
+            if n:
                 gdbh.commit()
             else:
                 _w( "No episodes found for modification.")
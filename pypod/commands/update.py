@@ -24,8 +24,10 @@
 
 # standard library imports
 from __future__ import print_function, unicode_literals
-import logging, sys, time
+import hashlib, logging, random, sys, time, traceback
+from collections import Counter
 from optparse import OptionParser
+from urlparse import urlparse
 try:
     str = unicode
 except NameError:
@@ -45,10 +47,16 @@ except ImportError:
 
 # Other pypod modules
 from pypod.lib.config import get_option
-from pypod.lib.db import add_episode, get_selected_podcasts, update_podcast
+from pypod.lib.db import add_episodes, get_episode_keys, \
+                         get_selected_podcasts, touch_podcasts, update_podcast
 from pypod.lib.datatypes import Episode, EpisodeStatus, PCEnabled
-from pypod.lib.url_getter import cached_get
+from pypod.lib.feedstream import parse_feed
+from pypod.lib.schedule import parse_duration
+from pypod.lib import stats
+from pypod.lib.throttle import get_limiter
+from pypod.lib.url_getter import feed_get, retry_after
 from pypod.lib.utils import generic_id_help, mutex, sanitize_basic
+from pypod.lib.workers import WorkerPool, completed
 
 
 __author__    = "Robert N. Evans <http://home.earthlink.net/~n1be/>"
@@ -71,7 +79,7 @@ def _w( msg):
     logging.warning( "update: " + str( msg))
 
 
-_usage_text = "Usage: %prog update [<castid>...]"
+_usage_text = "Usage: %prog update [options] [<castid>...]"
 _helptext = _usage_text + """
 
 Running update will cause %prog to look at each requested podcast.  This
@@ -79,6 +87,24 @@ will download the feed for each enabled podcast and update the database of
 available episodes.  It will not actually download any episodes; see the
 download command for that.
 
+Feeds are fetched by several threads at once, updatethreads by default,
+but the database is updated one podcast at a time in podcast ID order.
+
+With --due-only, only the podcasts that are due are updated.  Each podcast
+is next due after a quarter of the time its new episodes take to appear,
+as learned from past updates, or of the time since its last new episode if
+that is longer; but no sooner than minupdateinterval and no later than
+maxupdateinterval from its section.
+
+A podcast whose update fails is not tried again until minupdateinterval has
+passed, doubling with each failure up to maxretryinterval, or as long as
+the server asks if that is longer.  Until then update skips it.
+
+A feed that has not changed since the last update is not read again.  A
+feed that has is only read up to the point where its episodes are already
+known, unless --full is given, the podcast is new, or the feed is not in
+newest first order.
+
 """ + generic_id_help( "podcast")
 
 
@@ -99,8 +125,24 @@ def _handle_parse_error( d, pc, gcp, gdbh):
     _handle_feed_error( pc, gcp, gdbh)
 
 
-def _handle_feed_error( pc, gcp, gdbh):
+def _backoff( pc, gcp, wait=None):
+    """Return the seconds to wait before trying a failing feed again: from
+    minupdateinterval, doubled with each failure up to maxretryinterval, of
+    which up to half is random so that feeds that failed together are tried
+    apart; but at least wait, as asked by the server"""
+    low = parse_duration( get_option( gcp, pc.castid, "minupdateinterval"))
+    high = parse_duration( get_option( gcp, pc.castid, "maxretryinterval"))
+    delay = min( high, low * 2 ** min( pc.failedattempts - 1, 30))
+    delay = delay / 2 + random.uniform( 0, delay / 2)
+    if wait is not None:
+        delay = max( delay, wait)
+    return int( delay)
+
+
+def _handle_feed_error( pc, gcp, gdbh, wait=None):
     pc.failedattempts = pc.failedattempts + 1
+    pc.nextdue = pc.lastattempt + _backoff( pc, gcp, wait)
+    _i( "Next try no sooner than {0.due}".format( pc))
     # Consider whether to disable this feed
     faildays = int( get_option( gcp, pc.castid, "podcastfaildays"))
     failattempts = int( get_option( gcp, pc.castid, "podcastfailattempts"))
@@ -175,79 +217,291 @@ def _item_to_ep( encl, ie, item, pc):
                     epfailedattempts=0)
 
 
-def _update_enclosure( encl, ie, item, pc, gcp, gdbh):
-    "Apply feed info to one enclosure"
-    ep = _item_to_ep( encl, ie, item, pc)
-    if ep == None:
-        return 0
-    newc = add_episode( gdbh, ep)
-    gdbh.commit()
-    if newc:
-        _i( "   +--> {0.title}".format( ep)) 
-    return newc
-
-
-def _update_feed( d, pc, gcp, gdbh):
-    "Apply feed info to this podcast"
+def _update_feed( d, pc, gcp, gdbh, tally):
+    """Apply feed info to this podcast, counting the new, changed and
+    untouched episodes in tally.  Returns the number of new episodes."""
+    new = []
     if d.has_key( 'entries'):
-        count = 0
+        eps = []
         # Reverse list so newest entries are last.  This is compatible with
         # future updates that will add the new episodes with higher epid's.
         # Otherwise the 'catchup' will be broken
         for item in reversed( d.entries):
             if item.has_key( 'enclosures'):
                 for ie, encl in enumerate( item.enclosures):
-                    count += _update_enclosure( encl, ie, item, pc, gcp, gdbh)
-        if count:
-            _d( "   Added {0} new episodes".format( count))
+                    ep = _item_to_ep( encl, ie, item, pc)
+                    if ep != None:
+                        eps.append( ep)
+        with stats.timed( "episodes"):
+            new, changed, untouched = add_episodes( gdbh, pc, eps)
+            gdbh.commit()
+        for ep in new:
+            _i( "   +--> {0.title}".format( ep))
+        _d( "   {0} new, {1} changed, {2} untouched episodes".format(
+            len( new), changed, untouched))
+        tally[ "new"] += len( new)
+        tally[ "changed"] += changed
+        tally[ "untouched"] += untouched
     if pc.castname == "" and d.feed.has_key( 'title'):
         pc.castname = sanitize_basic( d.feed.title).strip()
+    return len( new)
+
+
+_polls_per_cadence = 4  # Updates wanted in the time between new episodes
+
+
+def _plan_next_update( pc, gcp, new):
+    """Learn the publishing cadence of a podcast that was just updated and
+    found new episodes, and set when it is next due for an update"""
+    now = pc.lastupdate
+    if new:
+        if pc.lastnew:
+            gap = now - pc.lastnew
+            if pc.cadence is None:
+                pc.cadence = gap
+            else:
+                pc.cadence = ( 3 * pc.cadence + gap) // 4
+        pc.lastnew = now
+    # A podcast that has gone quiet is checked less and less often
+    quiet = now - pc.lastnew if pc.lastnew else 0
+    interval = max( pc.cadence or 0, quiet) / _polls_per_cadence
+    low = parse_duration( get_option( gcp, pc.castid, "minupdateinterval"))
+    high = parse_duration( get_option( gcp, pc.castid, "maxupdateinterval"))
+    pc.nextdue = now + int( min( max( interval, low), high))
+    _d( "cadence {0}, next due {1}".format( pc.cadence, pc.nextdue))
+
+
+_known_run = 10     # Known items in a row after which a feed is not read
+
+
+class _KnownRun( object):
+    """Tell parse_feed to stop once _known_run items in a row are all in the
+    database.  Items that are not known must all come before them, and the
+    known ones must be newest first, as update numbers them; otherwise the
+    feed has been reordered and is marked for a full parse."""
+
+    def __init__( self, known):
+        self.known = known      # guid or url -> episodeid
+        self.run = 0
+        self.last = None        # episodeid of the last known item
+        self.reordered = False
+
+    def __call__( self, item):
+        if not item.get( 'enclosures'):
+            return False
+        ids = []
+        for ie, encl in enumerate( item.get( 'enclosures', [])):
+            keys = []
+            if item.has_key( 'id'):
+                guid = sanitize_basic( item.id).strip()
+                if len( item.enclosures) > 1:
+                    guid += "/{0}".format( ie)
+                keys.append( guid)
+            if encl.has_key( 'href'):
+                keys.append( sanitize_basic( encl.href).strip())
+            ids.extend( self.known[ k] for k in keys if k in self.known)
+        if not ids:
+            # A new item; only the ones before the known ones are expected
+            self.reordered = self.last is not None
+            return self.reordered
+        if self.last is not None and max( ids) >= self.last:
+            self.reordered = True
+            return True
+        self.last = min( ids)
+        self.run += 1
+        return self.run >= _known_run
+
+
+def _fetch_feed( pc, limiter=None, full=False):
+    """Fetch one podcast feed.  This runs on a worker thread, so it must not
+    touch the database.  Unless full is set, the request is conditional on
+    the validators saved with the podcast.  Returns ( response, body, body
+    hash); the response is None if the feed could not be fetched, and the
+    rest are None if it did not change since the last query or the server
+    is too busy.  A body that is the same as the last one processed is not
+    returned, unless full is set; then only the body is None."""
+    with stats.podcast( pc.castid):
+        pc.lastattempt = int( time.time())
+        if full:
+            resp, content = feed_get( pc.feedurl, limiter=limiter)
+        else:
+            resp, content = feed_get( pc.feedurl, pc.etag, pc.lastmodified,
+                                      limiter)
+        if not resp or resp.status == 304 or content is None:
+            return resp, None, None
+        bodyhash = hashlib.sha1( content).hexdigest().decode( 'ascii')
+        if bodyhash == pc.bodyhash and not full:
+            return resp, None, bodyhash
+        return resp, content, bodyhash
+
+
+def _parse_feed( pc, content, known):
+    """Parse the body of a feed that has changed.  This also runs on a
+    worker thread.  known maps the guids and urls of the podcast's episodes
+    to their episodeids.  If it is not empty, the feed is parsed
+    incrementally, up to the first run of known items; otherwise, or if it
+    is reordered, the whole feed is parsed by feedparser."""
+    with stats.podcast( pc.castid):
+        if known:
+            stop = _KnownRun( known)
+            with stats.timed( "parse"):
+                d = parse_feed( content, stop)
+            if d is not None and not stop.reordered:
+                _d( "read {0} items of the feed".format( len( d.entries)))
+                return d
+            _d( "reading the whole feed")
+      # d = feedparser.parse( pc.feedurl)
+        with stats.timed( "parse"):
+            return feedparser.parse( content)
+
+
+def _save_validators( pc, resp):
+    "Note the validators of a feed response; tell whether they changed"
+    etag = ( resp.getheader( 'etag') or b'').decode( 'latin-1')
+    lastmodified = ( resp.getheader( 'last-modified') or b'').decode( 'latin-1')
+    changed = ( etag, lastmodified) != ( pc.etag, pc.lastmodified)
+    pc.etag = etag
+    pc.lastmodified = lastmodified
+    return changed
 
 
-def _update_podcast( pc, gcp, gdbh):
-    "update one podcast feed"
+def _update_podcast( pc, gcp, gdbh, tally, resp, d, bodyhash):
+    """update one podcast feed with the results of _fetch_feed() and
+    _parse_feed(), adding its episode counts to tally.  Returns True if the
+    feed has not changed; the caller records that for all such podcasts at
+    once, with touch_podcasts()."""
     _i( " * Podcast {0.castid}: {1}".format( pc, pc.castname or pc.feedurl))
-    pc.lastattempt = int( time.time())
-    resp, content = cached_get( pc.feedurl)
     if not resp:
         _handle_feed_error( pc, gcp, gdbh)
-        return
+        return False
+    if resp.status >= 400:
+        # Too busy; try again when the server says
+        _handle_feed_error( pc, gcp, gdbh, retry_after( resp))
+        return False
     if resp.status == 304:
         # Not changed since last query
         _i( "HTTP status {0.status} - {0.reason}".format( resp))
+        pc.lastupdate = int( time.time())
+        _plan_next_update( pc, gcp, 0)
+        return True
+    new = 0
+    if d is None:
+        # Same content as last time, but the server could not tell
+        _i( "Feed content unchanged")
+        pc.lastupdate = int( time.time())
+        if not _save_validators( pc, resp):
+            _plan_next_update( pc, gcp, 0)
+            return True
+    elif d.bozo:
+        _handle_parse_error( d, pc, gcp, gdbh)
+        return False
     else:
-      # d = feedparser.parse( pc.feedurl)
-        d = feedparser.parse( content)
-        if d.bozo:
-            _handle_parse_error( d, pc, gcp, gdbh)
-            return
         _d( " . feed download complete")
         _show_feed_details( d)
-        _update_feed( d, pc, gcp, gdbh)
+        new = _update_feed( d, pc, gcp, gdbh, tally)
+        _save_validators( pc, resp)
+        pc.bodyhash = bodyhash
     pc.lastupdate = int( time.time())
     pc.failedattempts = 0
+    _plan_next_update( pc, gcp, new)
     update_podcast( gdbh, pc)
     gdbh.commit()
+    return False
 
 
 def _update_worker( args, gcp, gdbh):
     "Re-scan enabled feeds and update list of needed downloads"
     parser = OptionParser( usage=_helptext)
+    parser.add_option( "-j", "--jobs", dest="jobs", type="int",
+                       help="Fetch up to JOBS feeds at once; overrides the "
+                            "updatethreads option")
+    parser.add_option( "--full", dest="full", action="store_true",
+                       default=False,
+                       help="Read every feed completely, even if it has not "
+                            "changed")
+    parser.add_option( "--due-only", dest="due_only", action="store_true",
+                       default=False,
+                       help="Only update the podcasts that are due")
     (options, args) = parser.parse_args( args=args)
     podcasts = filter( lambda pc: pc.is_enabled,
                        get_selected_podcasts( gdbh, args))
-    _i( "{0} podcast(s) to consider:".format( len( podcasts)))
+    now = int( time.time())
+    if options.due_only:
+        podcasts = filter( lambda pc: ( pc.nextdue or 0) <= now, podcasts)
     for pc in podcasts:
-        try:
-            _update_podcast( pc, gcp, gdbh)
-        except KeyboardInterrupt:
-            _i( "Interrupted by Ctrl-C")
-            return
+        if pc.failedattempts and ( pc.nextdue or 0) > now:
+            _i( " * Podcast {0.castid}: failing, skipped until {0.due}"
+                .format( pc))
+    # Failing podcasts are left alone until their next try is due
+    podcasts = filter( lambda pc: not pc.failedattempts or
+                                  ( pc.nextdue or 0) <= now, podcasts)
+    _i( "{0} podcast(s) to consider:".format( len( podcasts)))
+    limiter = get_limiter( gcp, "general", "feedmaxrate")
+    # Feeds are fetched on the pool threads, and those that changed are then
+    # parsed on the parse pool threads.  This thread is the only DB writer;
+    # it applies the results in submission order, whatever order they
+    # arrive in, so that runs are repeatable.
+    pool = WorkerPool( options.jobs or
+                       int( get_option( gcp, "general", "updatethreads")))
+    parse_pool = WorkerPool( pool.nthreads, results=pool.results)
+    for i, pc in enumerate( podcasts):
+        host = urlparse( pc.feedurl).netloc.lower()
+        limit = int( get_option( gcp, pc.castid, "maxhostthreads"))
+        # A maxhostthreads of 0 or less sets no limit
+        pool.submit( _fetch_feed, ( pc, limiter, options.full), tag=i,
+                     limits=limit > 0 and [ ( host, limit)] or [])
+    pool.close()
+    fetched = {}    # tag -> ( response, body hash) of a feed being parsed
+    arrived = {}
+    applied = 0
+    unchanged = []
+    tally = Counter()
+    try:
+        for job, result, exc in completed( pool, parse_pool):
+            if exc:
+                # Print error and treat it as a failure to fetch the feed
+                traceback.print_exception( *exc)
+                fetched.pop( job.tag, None)
+                result = None, None, None
+            elif job.func == _parse_feed:
+                resp, bodyhash = fetched.pop( job.tag)
+                result = resp, result, bodyhash
+            elif result[ 1] is not None:
+                # Only a changed feed needs the keys of the known episodes
+                resp, content, bodyhash = result
+                pc = podcasts[ job.tag]
+                known = None if options.full else get_episode_keys( gdbh, pc)
+                fetched[ job.tag] = resp, bodyhash
+                parse_pool.submit( _parse_feed, ( pc, content, known),
+                                   tag=job.tag)
+                continue
+            arrived[ job.tag] = result
+            while applied in arrived:
+                pc = podcasts[ applied]
+                with stats.podcast( pc.castid):
+                    if _update_podcast( pc, gcp, gdbh, tally,
+                                        *arrived.pop( applied)):
+                        unchanged.append( pc)
+                applied += 1
+    except KeyboardInterrupt:
+        pool.shutdown()
+        parse_pool.shutdown()
+        _i( "Interrupted by Ctrl-C")
+        return
+    finally:
+        touch_podcasts( gdbh, unchanged)
+        gdbh.commit()
+    parse_pool.close()
+    pool.join()
+    parse_pool.join()
+    if tally:
+        _i( "Episodes: {0[new]} new, {0[changed]} changed, "
+            "{0[untouched]} untouched".format( tally))
 
 
 def _cmd_worker( args, gcp, gdbh):
     "Hold database mutex while running the update command"
-    with mutex():
+    with mutex(), stats.timed( "update"):
         _update_worker( args, gcp, gdbh)
 
 
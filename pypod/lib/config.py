@@ -79,14 +79,28 @@ def get_default_config():
     cp.set( "DEFAULT", "downloaddir", downloaddir)
     cp.set( "DEFAULT", "namingpatt", "%(safecasttitle)s/%(safefilename)s")
     cp.set( "DEFAULT", "maxthreads", "2")
+    cp.set( "DEFAULT", "downloadorder", "feed")
+    cp.set( "DEFAULT", "updatethreads", "4")
+    cp.set( "DEFAULT", "maxhostthreads", "2")
+    cp.set( "DEFAULT", "keepalivetime", "30s")
+    cp.set( "DEFAULT", "maxrate", "0")
+    cp.set( "DEFAULT", "feedmaxrate", "0")
     cp.set( "DEFAULT", "progressinterval", "1")
+    cp.set( "DEFAULT", "preallocate", "no")
+    cp.set( "DEFAULT", "syncdownloads", "no")
+    cp.set( "DEFAULT", "minupdateinterval", "1h")
+    cp.set( "DEFAULT", "maxupdateinterval", "7d")
+    cp.set( "DEFAULT", "maxretryinterval", "1d")
     cp.set( "DEFAULT", "podcastfaildays", "21")
     cp.set( "DEFAULT", "podcastfailattempts", "15")
     cp.set( "DEFAULT", "epfaildays", "21")
     cp.set( "DEFAULT", "epfailattempts", "15")
     cp.set( "DEFAULT", "renametypes",
-            "audio/mpeg:.mp3,audio/mp3:.mp3,x-audio/mp3:.mp3")
+            "audio/mpeg:.mp3,audio/mp3:.mp3,x-audio/mp3:.mp3," +
+            "audio/mp4:.m4a,audio/ogg:.ogg,audio/opus:.opus," +
+            "video/mp4:.mp4,video/x-m4v:.m4v,application/pdf:.pdf")
     cp.set( "DEFAULT", "postproctypes", "audio/mpeg,audio/mp3,x-audio/mp3")
+    cp.set( "DEFAULT", "postprocthreads", "2")
     cp.set( "DEFAULT", "gettypecommand", "file -b -i \"${EPFILENAME}\"")
     cp.set( "DEFAULT", "postproccommand",
             "mid3v2 -A \"${CASTTITLE}\" -t \"${EPTITLE}\" -T ${EPID}" +
@@ -111,14 +125,18 @@ def store_config( cp):
     cp.write( get_config_path())
 
 
-def get_max_threads():
-    """Returns the integer max_threads value in the configuration"""
-    return load_config().getint( "general", "maxthreads")
+def get_max_threads( cp=None, sect="general"):
+    """Returns the integer max_threads value in the configuration.
+The value in the "general" section sizes the pool of download threads;
+a value in a podcast's section limits concurrent downloads of that podcast."""
+    return int( get_option( cp or load_config(), sect, "maxthreads"))
 
 
-def get_progress_interval():
-    """Returns the integer progress_interval value in the configuration"""
-    return load_config().getint( "general", "progressinterval")
+def get_progress_interval( cp=None):
+    """Returns the integer progress_interval value in the configuration.
+This is the number of seconds between download progress reports; zero
+turns the reports off."""
+    return int( get_option( cp or load_config(), "general", "progressinterval"))
 
 
 def get_option( cp, sect, key, vars={}):
@@ -127,3 +145,9 @@ def get_option( cp, sect, key, vars={}):
         return cp.get( str( sect), key, vars=vars)
     except ConfigParser.NoSectionError:
         return cp.get( "DEFAULT", key, vars=vars)
+
+
+def get_bool_option( cp, sect, key):
+    """Returns the boolean value of one configured option"""
+    return get_option( cp, sect, key).strip().lower() in \
+               ( "1", "yes", "true", "on")
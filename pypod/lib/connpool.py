@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026, Robert N. Evans
+
+#
+# PyPod - A podcast media aggregator.  This program is a re-implementation
+# of John Goerzen's no longer supported hpodder utility.
+#
+# PyPod is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPod is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""This file implements a pool of persistent HTTP connections.  Feeds and
+enclosures mostly live on a few hosts, so a connection that is done with
+one request is kept open for the next request to the same scheme, host and
+port, on whichever thread.  That saves the TCP and TLS handshakes."""
+
+# standard library imports
+from __future__ import print_function, unicode_literals
+import httplib
+import logging
+import sys
+import threading
+import time
+try:
+    str = unicode
+except NameError:
+    pass
+
+
+__author__    = "Robert N. Evans <http://home.earthlink.net/~n1be/>"
+__copyright__ = "Copyright (C) 2026 {0}. All rights reserved.".format( __author__)
+__date__      = "2026-10-17"
+__license__   = "GPLv3"
+__version__   = "0.1"
+
+
+def _d( msg):
+    "Print debugging messages"
+    logging.debug( "pool: " + str( msg))
+
+
+_classes = { "http": httplib.HTTPConnection,
+             "https": httplib.HTTPSConnection}
+
+
+class ConnectionPool( object):
+    """Idle HTTP connections, keyed by ( scheme, host, port).  At most
+    max_per_host idle connections are kept for each key, each for at most
+    idle_timeout seconds, since servers drop idle connections themselves
+    sooner or later.
+      get() returns a connection and whether it is reused; a connection
+    that is new must still be connected.  Once a response has been read to
+    its end, release() puts its connection back; otherwise the connection
+    is closed, since the rest of the response would be in the way."""
+
+    def __init__( self, max_per_host=2, idle_timeout=30):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.opened = 0
+        self.reused = 0
+        self._idle = {}     # key -> [ ( connection, time it went idle)]
+        self._lock = threading.Lock()
+
+    def get( self, scheme, host, port, timeout):
+        "Return ( connection, reused) for a request to scheme://host:port"
+        key = ( scheme, host, port)
+        now = time.time()
+        with self._lock:
+            idle = self._idle.get( key, [])
+            while idle:
+                conn, since = idle.pop()
+                if now - since <= self.idle_timeout:
+                    _d( "reusing a connection to {0}://{1}:{2}".format(
+                        *key))
+                    self.reused += 1
+                    conn.sock.settimeout( timeout)
+                    return conn, True
+                conn.close()
+            self.opened += 1
+        conn = _classes[ scheme]( host.encode( 'idna'), port,
+                                  timeout=timeout)
+        conn.pool_key = key
+        return conn, False
+
+    def release( self, response, conn):
+        """Put conn back for the next request, if its response has been read
+        to the end and it is to be kept alive; otherwise close it"""
+        if not response.isclosed() and response.length == 0:
+            response.close()    # No body, as for a 304 response
+        if not response.isclosed() or response.will_close or \
+           conn.sock is None:
+            response.close()
+            conn.close()
+            return
+        with self._lock:
+            idle = self._idle.setdefault( conn.pool_key, [])
+            if len( idle) < self.max_per_host:
+                idle.append( ( conn, time.time()))
+                return
+        conn.close()
+
+    def close( self):
+        "Close all the idle connections"
+        with self._lock:
+            for idle in self._idle.values():
+                for conn, since in idle:
+                    conn.close()
+            self._idle.clear()
+
+## --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --
+
+def test():
+    "Test code to run when invoked on the command line"
+    import BaseHTTPServer
+    print( __doc__)
+    print()
+
+    class Handler( BaseHTTPServer.BaseHTTPRequestHandler):
+        protocol_version = b"HTTP/1.1"
+
+        def do_GET( self):
+            body = b"hello"
+            if self.path == b"/close":
+                self.close_connection = 1
+            self.send_response( 304 if self.path == b"/304" else 200)
+            if self.path != b"/304":
+                self.send_header( b"Content-Length", str( len( body)))
+            if self.close_connection:
+                self.send_header( b"Connection", b"close")
+            self.end_headers()
+            if self.path != b"/304":
+                self.wfile.write( body)
+
+        def log_message( self, *args):
+            pass
+
+    class Server( BaseHTTPServer.HTTPServer):
+        def handle_error( self, request, client_address):
+            pass    # The client resets the connections it abandons
+
+    server = Server( ( b"127.0.0.1", 0), Handler)
+    port = server.server_address[ 1]
+    thread = threading.Thread( target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    pool = ConnectionPool( max_per_host=1)
+    for path, read in ( ( "/", True), ( "/304", False), ( "/", True),
+                        ( "/", False), ( "/close", True), ( "/", True)):
+        conn, reused = pool.get( "http", "127.0.0.1", port, 5)
+        conn.request( b"GET", path.encode( 'ascii'))
+        response = conn.getresponse()
+        if read:
+            response.read()
+        pool.release( response, conn)
+        print( "GET {0:7} read body {1!s:5} reused {2}".format( path, read,
+                                                              reused))
+    print( "opened {0.opened}, reused {0.reused}".format( pool))
+    # Only an unread body or Connection: close forces a new connection
+    if ( pool.opened, pool.reused) != ( 3, 3):
+        raise AssertionError( "Connections were not reused as expected")
+    pool.close()
+    server.shutdown()
+    print( "\n   DONE.")
+
+if __name__ == '__main__':
+    # Run test code when invoked on the command line
+    sys.exit( test())
@@ -61,65 +61,86 @@ EpisodeStatus = enum.Enum( 'Pending',	# Ready to download
 # Enum of whether podcast is enabled
 PCEnabled = enum.Enum( 'UserDisabled', 'Enabled', 'ErrorDisabled')
 
+def enum_table( type):
+    "Return a dict from the names of an enumerated type to its values"
+    return dict( ( value.key, value) for value in type)
+
+_enum_tables = { EpisodeStatus: enum_table( EpisodeStatus),
+                 PCEnabled: enum_table( PCEnabled)}
+
 def string_to_enum( str, type):
     "Convert a string to an enumerated value"
-    if str not in type:
+    table = _enum_tables.get( type) or enum_table( type)
+    try:
+        return table[ str]
+    except KeyError:
         raise AttributeError( "{0!s} object has no attribute '{1!s}'"
                               .format( type, str))
-    exec "choice = type.{0}".format( str)
-    return choice
 
 
-class _AppDict( dict):
-    """Dictionary-like superclass for application datatypes:
-    Members cannot be added or deleted after initialization.
-    The data type of member value is not allowed to change."""
+_validating = True
+
+def _checked_setattr( self, name, value):
+    "Apply constraints upon setting member values"
+    if name not in self._defaults:
+        raise AttributeError( "'{0!s}' has no member '{1!s}'"
+                              .format( self.__class__, name))
+    try:
+        old = getattr( self, name)
+    except AttributeError:
+        old = self._defaults[ name]     # Not set yet, by __init__
+    if old != None or \
+       value == None:
+        oldtype = type( old)
+    else:
+        oldtype = int # None can become an int
+    newtype = type( value)
+    if newtype == oldtype:
+        object.__setattr__( self, name, value)
+    else:
+        raise TypeError( "{0!s}[({1!s})'{2!s}'] cannot store '{3!s}'"
+                         .format( self.__class__, oldtype, name, newtype))
+
+class _Record( object):
+    """Superclass for application datatypes:
+    The members are the keys of _defaults in each subclass, kept in
+    __slots__.  Members cannot be added or deleted.
+    While validation is on, the data type of a member value is not allowed
+    to change; see set_validation()."""
+    __slots__ = ()
+    _defaults = {}
+
+    __setattr__ = _checked_setattr
 
-    def __init__( self, **members):
-        super( _AppDict, self).__init__( members)
+    def __delattr__( self, name):
+        raise AttributeError( "Can not delete members from {0!s}"
+                              .format( self.__class__))
 
     def __repr__( self):
         str = ""
-        for key in sorted( self.keys()):
-            str = "{0}, {1!s}:{2!r}".format( str, key, self[key])
+        for key in sorted( self._defaults):
+            str = "{0}, {1!s}:{2!r}".format( str, key, getattr( self, key))
         return "{0!s}({1})".format(self.__class__, str[1:])
 
-    def __getattribute__( self, name):
-        "Allow reading member value as an attribute"
-        try:
-            return self[ name]
-        except KeyError:
-            # Read an actual attribute
-            return super( _AppDict, self).__getattribute__( name)
-
-    def __setattr__( self, name, value):
-        "Allow setting member value as an attribute"
-        try:
-            self[ name] = value;
-        except KeyError:
-            # Create or Modify actual attribute
-            super( _AppDict, self).__setattr__( name, value)
-
-    def __setitem__( self, key, value):
-        "Apply constraints upon setting member values"
-        if key not in self:
-            raise KeyError( "'{0!s}' has no member '{1!s}'"
-                            .format( self.__class__, key))
-        if self[ key] != None or \
-           value == None:
-            oldtype = type( self[ key])
-        else:
-            oldtype = int # None can become an int
-        newtype = type( value)
-        if newtype == oldtype:
-            super( _AppDict, self).__setitem__( key, value)
-        else:
-            raise TypeError( "{0!s}[({1!s})'{2!s}'] cannot store '{3!s}'"
-                             .format( self.__class__, oldtype, key, newtype))
-
-    def __delitem__( self, key):
-        raise TypeError( "Can not delete members from {0!s}"
-                         .format( self.__class__))
+    @classmethod
+    def member_setters( cls):
+        """Return a dict from the member names to functions ( record, value)
+        that set them without any checks, for building records from data
+        that is known to be right, such as rows read from the database.
+        object.__new__( cls) makes a record with no members set."""
+        return dict( ( name, getattr( cls, name).__set__)
+                     for name in cls.__slots__)
+
+def set_validation( on):
+    """Turn the checks of member types on or off.  They are on by default;
+    the pypod command turns them off unless it runs with --debug, which
+    makes creating and updating records cheaper."""
+    global _validating
+    _validating = bool( on)
+    if _validating:
+        _Record.__setattr__ = _checked_setattr
+    elif '__setattr__' in vars( _Record):
+        del _Record.__setattr__
 
 def _human_size( size):
     "Convert size_t to a \"human\" size."
@@ -151,7 +172,7 @@ def _tm_to_str( t):
 
 ## --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  -- 
 
-class Podcast( _AppDict):
+class Podcast( _Record):
     """Data about feeds that have been subscribed
     { castid ::         Integer,
       castname ::       String,
@@ -159,19 +180,39 @@ class Podcast( _AppDict):
       pcenabled ::      PCEnabled,
       lastupdate ::     Maybe Integer, -- Last successful update
       lastattempt ::    Maybe Integer, -- Last attempt
-      failedattempts :: Integer}       -- failed attempts since last success
+      failedattempts :: Integer,       -- failed attempts since last success
+      etag ::           String,        -- validators of the last feed fetched
+      lastmodified ::   String,
+      bodyhash ::       String,        -- SHA-1 of the last feed fetched
+      nextdue ::        Maybe Integer, -- When the feed is next due for update
+      cadence ::        Maybe Integer, -- Seconds between new episodes, learned
+      lastnew ::        Maybe Integer} -- Last update that found new episodes
 """
 
-    def __init__( self, feedurl, castid=0, castname='', pcenabled=PCEnabled.Enabled,
-                  failedattempts=0, lastupdate=None, lastattempt=None):
+    _defaults = dict( castid=0, castname='', feedurl='',
+                      pcenabled=PCEnabled[0], lastupdate=None,
+                      lastattempt=None, failedattempts=0, etag='',
+                      lastmodified='', bodyhash='', nextdue=None,
+                      cadence=None, lastnew=None)
+    __slots__ = tuple( sorted( _defaults))
 
-        # First initialize dict to establish keys and datatypes
-        super( Podcast, self).__init__( castid=0, castname='', feedurl='',
-                                        pcenabled=PCEnabled[0], lastupdate=None,
-                                        lastattempt=None, failedattempts=0)
-        for mbr in ( 'castid', 'castname', 'feedurl', 'pcenabled',
-                     'failedattempts', 'lastupdate', 'lastattempt'):
-            exec ( "self[ '{0}'] = {0}".format( mbr))
+    def __init__( self, feedurl, castid=0, castname='', pcenabled=PCEnabled.Enabled,
+                  failedattempts=0, lastupdate=None, lastattempt=None,
+                  etag='', lastmodified='', bodyhash='', nextdue=None,
+                  cadence=None, lastnew=None):
+        self.castid = castid
+        self.castname = castname
+        self.feedurl = feedurl
+        self.pcenabled = pcenabled
+        self.failedattempts = failedattempts
+        self.lastupdate = lastupdate
+        self.lastattempt = lastattempt
+        self.etag = etag
+        self.lastmodified = lastmodified
+        self.bodyhash = bodyhash
+        self.nextdue = nextdue
+        self.cadence = cadence
+        self.lastnew = lastnew
 
     @property
     def is_enabled( self):
@@ -194,13 +235,17 @@ class Podcast( _AppDict):
     def updated( self):
         return _tm_to_str( self.lastupdate)
 
+    @property
+    def due( self):
+        return _tm_to_str( self.nextdue)
+
     def __str__( self):
         return "Podcast {0} {1}{2}".format( self.castid, self.disabled_str,
                                              self.castname)
 
 ## --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  -- 
 
-class Episode( _AppDict):
+class Episode( _Record):
     """Data about one enclosure/attachment
     {podcast ::          Podcast,
      epid ::             Integer,
@@ -215,23 +260,30 @@ class Episode( _AppDict):
      epfailedattempts :: Integer}
 """
 
+    _defaults = dict( podcast=None, episodeid=0, title='', epurl='',
+                      epguid='', enctype='', epstatus=EpisodeStatus[ 0],
+                      eplength=0, epfirstattempt=None, eplastattempt=None,
+                      epfailedattempts=0)
+    __slots__ = tuple( sorted( _defaults))
+
     def __init__( self, podcast, episodeid, title, epurl, epguid, enctype,
                   epstatus, eplength, epfirstattempt=None, eplastattempt=None,
                   epfailedattempts=0):
-        if type( podcast) != Podcast:
+        if _validating and type( podcast) != Podcast:
             raise TypeError( "'podcast'=:{0}: is not member of class Podcast" \
                              .format( podcast))
-            
-        # Initialize dict to establish datatypes
-        super( Episode, self).__init__( podcast=podcast, episodeid=0,
-            title='', epurl='', epguid='', enctype='',
-            epstatus=EpisodeStatus[ 0], eplength=0, epfirstattempt=None,
-            eplastattempt=None, epfailedattempts=0)
-
-        for mbr in ( 'podcast', 'episodeid', 'title', 'epurl', 'epguid',
-                     'enctype', 'epstatus', 'eplength', 'epfirstattempt',
-                     'eplastattempt', 'epfailedattempts'):
-            exec ( "self[ '{0}'] = {0}".format( mbr))
+        # The podcast member only ever holds a Podcast
+        object.__setattr__( self, 'podcast', podcast)
+        self.episodeid = episodeid
+        self.title = title
+        self.epurl = epurl
+        self.epguid = epguid
+        self.enctype = enctype
+        self.epstatus = epstatus
+        self.eplength = eplength
+        self.epfirstattempt = epfirstattempt
+        self.eplastattempt = eplastattempt
+        self.epfailedattempts = epfailedattempts
 
     @property
     def first_try( self):
@@ -344,9 +396,12 @@ def test():
         print( ". {0!r}".format( e))
 
     print("\n")
-    print( "CREATE A NEW ATTRIBUTE: p1.foo = 9 ...")
-    p1.foo = 9
-    print( "p1.foo: {0}".format( p1.foo))
+    try:
+        print( "INVALID: p1.foo = 9 ...")
+        p1.foo = 9
+        raise AssertionError( "Invalid attribute creation was not detected")
+    except AttributeError as e:
+        print( ". {0!r}".format( e))
 
     print("\n")
     print( "p1.castid = 6")
@@ -383,33 +438,17 @@ def test():
         print( ". {0!r}".format( e))
 
     print("\n")
-    print( "p1['feedurl'] = 'different_URL'")
-    p1['feedurl'] = 'different_URL'
-    print( "p1['feedurl']: {0}".format( p1['feedurl']))
-
-    print("\n")
-    try:
-        print( "INVALID: p1['baz']  ...")
-        p1['baz']
-        raise AssertionError( "Unknown key reference was not detected")
-    except KeyError as e:
-        print( ". {0!r}".format( e))
-
-    print("\n")
-    try:
-        print( "INVALID: p1['baz'] = 'foo' ...")
-        p1['baz'] = 'foo'
-        raise AssertionError( "Unknown key assignment was not detected")
-    except KeyError as e:
-        print( ". {0!r}".format( e))
+    print( "p1.feedurl = 'different_URL'")
+    p1.feedurl = 'different_URL'
+    print( "p1.feedurl: {0}".format( p1.feedurl))
 
     print("\n")
-    try:
-        print( "INVALID: del p1['pcenabled']  ...")
-        del p1['pcenabled']
-        raise AssertionError( "Invalid key deletion was not detected")
-    except TypeError as e:
-        print( ". {0!r}".format( e))
+    print( "set_validation( False); p1.castid = '9'")
+    set_validation( False)
+    p1.castid = '9'
+    print( "p1.castid: {0!r}".format( p1.castid))
+    p1.castid = 6
+    set_validation( True)
 
     print("\n")
     print( "p1.is_enabled: {0}, p1.disabled_str: {1}"
@@ -459,10 +498,65 @@ def test():
     print("\n")
     print( "repr(ep): {0!r}".format(ep))
 
+    benchmark()
+
     print("""
    DONE.
 """)
 
+
+class _DictRecord( dict):
+    "A record kept in a dict, as Podcast and Episode were; for benchmark()"
+
+    def __getattribute__( self, name):
+        try:
+            return self[ name]
+        except KeyError:
+            return super( _DictRecord, self).__getattribute__( name)
+
+def benchmark( n=200000):
+    """Compare the size of an Episode and the cost of reading and writing its
+    members with those of the same data in a dict based record, and the
+    cost of creating Episodes with and without validation"""
+    import timeit
+    print( "\n*** Benchmark: Episode and dict based records ...")
+    pc = Podcast( 'URL')
+    ep = Episode( pc, 1, 'title', 'url', 'guid', 'audio/mpeg',
+                  EpisodeStatus.Pending, 1000)
+    old = _DictRecord( ( name, getattr( ep, name)) for name in ep.__slots__)
+    sizes = ( sys.getsizeof( old), sys.getsizeof( ep))
+    print( ". bytes per record: dict {0}, slots {1}".format( *sizes))
+
+    def rate( func):
+        return n / min( timeit.repeat( func, number=n, repeat=3))
+
+    def make():
+        Episode( pc, 1, 'title', 'url', 'guid', 'audio/mpeg',
+                 EpisodeStatus.Pending, 1000)
+
+    def write_old():
+        old[ 'eplength'] = 2000
+
+    def write():
+        ep.eplength = 2000
+
+    reads = ( rate( lambda: old.title), rate( lambda: ep.title))
+    writes = ( rate( write_old), rate( write))
+    makes = [ rate( make)]
+    set_validation( False)
+    try:
+        writes += ( rate( write),)
+        makes.append( rate( make))
+    finally:
+        set_validation( True)
+    print( ". member reads/s: dict {0:.0f}, slots {1:.0f}".format( *reads))
+    print( ". member writes/s: dict (unchecked) {0:.0f}, slots checked"
+           " {1:.0f}, unchecked {2:.0f}".format( *writes))
+    print( ". Episodes made/s: checked {0:.0f}, unchecked {1:.0f}"
+           .format( *makes))
+    if sizes[ 1] >= sizes[ 0] or reads[ 1] <= reads[ 0]:
+        raise AssertionError( "Slots records are not smaller and faster")
+
 if __name__ == '__main__':
     # Run test code when invoked on the command line
     sys.exit( test())
@@ -25,7 +25,7 @@
 # standard library imports
 from __future__ import print_function, unicode_literals
 from itertools import groupby
-import logging, time
+import logging, os, time
 try:
     import sqlite3 as sqlite
 except:
@@ -37,7 +37,7 @@ except NameError:
 
 
 # Other PyPod modules
-from config import get_db_path, get_encl_tmp
+from config import get_db_path, get_encl_tmp, get_feed_cache
 from datatypes import *
 from utils import empty_dir, exe_name
 
@@ -50,6 +50,10 @@ __version__   = "0.3"
 
 
 _debug = 0
+_fetch_rows = 256 # rows fetched from a cursor at a time
+_max_ranges = 400 # ID ranges per statement, within SQLite's parameter limit
+_min_id = -1 << 63  # the ends of an open ID range
+_max_id = ( 1 << 63) - 1
 
 
 def _d( msg):
@@ -202,7 +206,70 @@ def _upgrade_schema( dbh, schemaver):
         _set_db_schema_version( dbh, sv)
         dbh.commit()
 
+    # Version 5 is the last one hpodder knows; it can not open the database
+    # once it is upgraded past that.
     if sv == 5:
+        sv = sv + 1
+        _d( "Upgrading database schema to version {0}".format( sv))
+        _d( '.creating "downloads" table')
+        dbh.executescript( """CREATE TABLE downloads
+                                ( castid INTEGER NOT NULL,
+                                  episodeid INTEGER NOT NULL,
+                                  epurl TEXT NOT NULL,
+                                  filename TEXT NOT NULL,
+                                  basename TEXT NOT NULL,
+                                  mediatype TEXT NOT NULL,
+                                  length INTEGER NOT NULL,
+                                  mtime INTEGER NOT NULL,
+                                  sha256 TEXT NOT NULL,
+                                  pristine INTEGER NOT NULL,
+                                  UNIQUE( castid, episodeid) );
+                              CREATE INDEX downloads_epurl
+                                  ON downloads( epurl);
+                              CREATE INDEX downloads_sha256
+                                  ON downloads( sha256);""")
+        _set_db_schema_version( dbh, sv)
+        dbh.commit()
+
+    if sv == 6:
+        sv = sv + 1
+        _d( "Upgrading database schema to version {0}".format( sv))
+        _d( '.adding "etag", "lastmodified" and "bodyhash" columns')
+        dbh.executescript( """ALTER TABLE podcasts
+                                  ADD etag TEXT;
+                              ALTER TABLE podcasts
+                                  ADD lastmodified TEXT;
+                              ALTER TABLE podcasts
+                                  ADD bodyhash TEXT;""")
+        _set_db_schema_version( dbh, sv)
+        dbh.commit()
+        # Feed validators are kept in the database now, so the cache of
+        # whole feed bodies that httplib2 kept is no longer used
+        empty_dir( get_feed_cache())
+
+    if sv == 7:
+        sv = sv + 1
+        _d( "Upgrading database schema to version {0}".format( sv))
+        _d( '.adding "nextdue", "cadence" and "lastnew" columns')
+        dbh.executescript( """ALTER TABLE podcasts
+                                  ADD nextdue INTEGER;
+                              ALTER TABLE podcasts
+                                  ADD cadence INTEGER;
+                              ALTER TABLE podcasts
+                                  ADD lastnew INTEGER;""")
+        _set_db_schema_version( dbh, sv)
+        dbh.commit()
+
+    if sv == 8:
+        sv = sv + 1
+        _d( "Upgrading database schema to version {0}".format( sv))
+        _d( '.creating "episodes_status" index')
+        dbh.execute( """CREATE INDEX episodes_status
+                            ON episodes( status, castid)""")
+        _set_db_schema_version( dbh, sv)
+        dbh.commit()
+
+    if sv == 9:
         _d( "At current supported database schema version: {0}".format( sv))
         pass
 
@@ -212,27 +279,106 @@ You probably need a newer {1} to read this database.""".format( sv, exe_name()))
 
 ## --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  -- 
 
-def _convrow( T, cols, row, pc=None):
-    "Convert a database row into an in-memory object of type T"
-    mbrs = {}
-    i = 0
-    now = int( time.time())
-    for c in cols:
+_pcenabled = tuple( PCEnabled)              # DB stores the index
+_statuses = enum_table( EpisodeStatus)      # DB stores the name
+_or_empty = lambda value: value or ''       # a missing guid or validator
+_mappers = {}   # ( T, column names) -> row converter
+
+def _mapper( T, description):
+    """Return a function that converts a database row into an in-memory
+    object of type T, given the row and, for an Episode, its podcast.  The
+    function is made once for each type and cursor.description, so that
+    converting a row only sets each member, with a table lookup for enum
+    columns, instead of sorting out every column again."""
+    cols = tuple( d[ 0] for d in description)
+    try:
+        return _mappers[ ( T, cols)]
+    except KeyError:
+        pass
+    setters = T.member_setters()
+    plain = []
+    fixes = []
+    set_podcast = None
+    for i, c in enumerate( cols):
         if c == 'pcenabled':
             # DB does not store enumerated types
-            mbrs[ c] = PCEnabled[ row[ i]]
+            fixes.append( ( setters[ c], i, _pcenabled.__getitem__))
         elif c == 'status':
-            mbrs[ 'epstatus'] = string_to_enum( row[ i], EpisodeStatus)
+            fixes.append( ( setters[ 'epstatus'], i, _statuses.__getitem__))
         elif T == Episode and c == 'castid':
             # DB does not store objects, an ID; use caller provided object
-            mbrs[ 'podcast'] = pc
-        elif c == 'epguid' and not row[ i]:
-            # handle a missing guid
-            mbrs[ c] = ''
+            set_podcast = setters[ 'podcast']
+        elif c in ( 'epguid', 'etag', 'lastmodified', 'bodyhash'):
+            fixes.append( ( setters[ c], i, _or_empty))
         else:
-            mbrs[ c] = row[ i]
-        i = i + 1
-    return T( **mbrs)
+            plain.append( ( setters[ c], i))
+    new = object.__new__
+
+    def convert( row, pc=None):
+        obj = new( T)
+        for set_member, i in plain:
+            set_member( obj, row[ i])
+        for set_member, i, fix in fixes:
+            set_member( obj, fix( row[ i]))
+        if set_podcast:
+            set_podcast( obj, pc)
+        return obj
+
+    _mappers[ ( T, cols)] = convert
+    return convert
+
+def _iter_rows( cur):
+    """Yield the rows of cur, fetching _fetch_rows of them at a time, so
+    that only a batch of rows is held in memory.  The iter_ functions below
+    are built on it.  Writing and committing while they are consumed is
+    fine, but a rollback on the connection ends them with an error."""
+    while True:
+        rows = cur.fetchmany( _fetch_rows)
+        if not rows:
+            return
+        for row in rows:
+            yield row
+
+def _id_ranges( wanted_ids):
+    """Turn the IDs and ID ranges selected on the command line, such as 12,
+    100-250, 300- and -20, into a sorted list of disjoint [ first, last]
+    pairs.  Overlapping and adjacent ones are merged, so that a run of
+    consecutive IDs becomes one range.  Anything else is ignored."""
+    ranges = []
+    for wanted in wanted_ids:
+        text = "{0}".format( wanted).strip()
+        first, sep, last = text.partition( '-')
+        try:
+            first = int( first) if first or not sep else _min_id
+            last = ( int( last) if last else _max_id) if sep else first
+        except ValueError:
+            first, last = 1, 0
+        if first > last or text == '-':
+            _w( "Ignoring ID {0!r}; use a number or a range such as 3-7"
+                .format( text))
+            continue
+        ranges.append( ( first, last))
+    merged = []
+    for first, last in sorted( ranges):
+        if merged and first <= merged[ -1][ 1] + 1:
+            merged[ -1][ 1] = max( merged[ -1][ 1], last)
+        else:
+            merged.append( [ first, last])
+    return merged
+
+def _select_ids( dbh, sql, params, column, wanted_ids):
+    """Run sql for the IDs and ID ranges of wanted_ids, yielding a cursor for
+    each statement.  sql has a {0} where the condition on the ID column
+    goes; it is one BETWEEN per range, for up to _max_ranges ranges at a
+    time.  As the ranges are disjoint and sorted, rows come out in ID order
+    and only once if sql orders them by column."""
+    ranges = _id_ranges( wanted_ids)
+    for i in range( 0, len( ranges), _max_ranges):
+        chunk = ranges[ i:i + _max_ranges]
+        cond = " OR ".join( [ "{0} BETWEEN ? AND ?".format( column)] *
+                            len( chunk))
+        yield dbh.execute( sql.format( cond),
+                           params + tuple( n for r in chunk for n in r))
 
 ## --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  -- 
 
@@ -249,148 +395,271 @@ A duplicate add is an error."""
                      ( pc.castname, pc.feedurl, pc.pcenabled.index,
                        pc.lastupdate, pc.lastattempt, pc.failedattempts) )
         pc.castid = dbh.execute(
-                        'SELECT castid FROM podcasts WHERE feedurl = :feedurl',
-                        pc ).fetchone()[0]
+                        'SELECT castid FROM podcasts WHERE feedurl = ?',
+                        ( pc.feedurl,) ).fetchone()[0]
     except:
         print( "Error adding feed {0.feedurl}\nPerhaps this URL is already subscribed?".format( pc), file=sys.stderr)
         raise
 
+def iter_all_podcasts( dbh):
+    """Yield all podcasts, in castid order, as the rows arrive."""
+    cur = dbh.execute( "SELECT * FROM podcasts ORDER BY castid")
+    convert = _mapper( Podcast, cur.description)
+    for row in _iter_rows( cur):
+        yield convert( row)
+
 def get_all_podcasts( dbh):
     """Return a list of all podcasts."""
-    res = []
-    cur = dbh.execute( "SELECT * FROM podcasts ORDER BY castid")
-    cols = map( lambda x: x[0], cur.description)
-    for row in cur.fetchall():
-        res.append( _convrow( Podcast, cols, row))
-    return res
+    return list( iter_all_podcasts( dbh))
+
+def iter_selected_podcasts( dbh, wanted_ids):
+    """Yield selected podcasts, in castid order.  wanted_ids may hold IDs
+    and ranges of them, which are looked up together; see _select_ids."""
+    if (len( wanted_ids) == 0) or ( wanted_ids[0] == 'all'):
+        for pc in iter_all_podcasts( dbh):
+            yield pc
+        return
+    for cur in _select_ids( dbh, """SELECT * FROM podcasts WHERE {0}
+                                    ORDER BY castid""",
+                            (), "castid", wanted_ids):
+        convert = _mapper( Podcast, cur.description)
+        for row in _iter_rows( cur):
+            yield convert( row)
 
 def get_selected_podcasts( dbh, wanted_ids):
     """Return a list of selected podcasts."""
-    if (len( wanted_ids) == 0) or ( wanted_ids[0] == 'all'):
-        return get_all_podcasts( dbh)
-    res = []
-    for pcid, grp in groupby( sorted( wanted_ids)): # eliminates duplicates
-        cur = dbh.execute( "SELECT * FROM podcasts WHERE castid = ?",
-                           ( pcid,))
-        cols = map( lambda x: x[0], cur.description)
-        row = cur.fetchone()
-        if row != None:
-            res.append( _convrow( Podcast, cols, row))
-    return res
+    return list( iter_selected_podcasts( dbh, wanted_ids))
 
 def update_podcast( dbh, pc):
     """Update one podcast row in the database
     The podcast row must already exist else the update request is ignored."""
     dbh.execute( """UPDATE podcasts
                       SET castname = ?, feedurl = ?, pcenabled = ?,
-                          lastupdate = ?, lastattempt = ?, failedattempts = ?
+                          lastupdate = ?, lastattempt = ?, failedattempts = ?,
+                          etag = ?, lastmodified = ?, bodyhash = ?,
+                          nextdue = ?, cadence = ?, lastnew = ?
                       WHERE castid = ?""",
                  ( pc.castname, pc.feedurl, pc.pcenabled.index, pc.lastupdate,
-                   pc.lastattempt, pc.failedattempts, pc.castid) )
+                   pc.lastattempt, pc.failedattempts, pc.etag,
+                   pc.lastmodified, pc.bodyhash, pc.nextdue, pc.cadence,
+                   pc.lastnew, pc.castid) )
+
+def touch_podcasts( dbh, podcasts):
+    """Record a successful update of podcasts whose feeds have not changed,
+    i.e. only their lastupdate, lastattempt, failedattempts and nextdue; one
+    statement serves all of them."""
+    dbh.executemany( """UPDATE podcasts
+                          SET lastupdate = ?, lastattempt = ?, failedattempts = 0,
+                              nextdue = ?
+                          WHERE castid = ?""",
+                     [ ( pc.lastupdate, pc.lastattempt, pc.nextdue, pc.castid)
+                       for pc in podcasts])
 
 
 def remove_podcast( dbh, pc):
     "Remove a podcast and related episodes from the database."
-    dbh.execute( 'DELETE FROM episodes WHERE castid = :castid', pc)
-    dbh.execute( 'DELETE FROM podcasts WHERE castid = :castid', pc)
+    dbh.execute( 'DELETE FROM episodes WHERE castid = ?', ( pc.castid,))
+    dbh.execute( 'DELETE FROM downloads WHERE castid = ?', ( pc.castid,))
+    dbh.execute( 'DELETE FROM podcasts WHERE castid = ?', ( pc.castid,))
     _d( "Vacuuming")
     dbh.execute( 'VACUUM')
 
 ## --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  -- 
 
-def get_all_pc_episodes( dbh, pc):
-    """Return a list of all episodes for one podcast."""
-    res = []
+def iter_all_pc_episodes( dbh, pc):
+    """Yield all episodes for one podcast, in episodeid order, as the rows
+    arrive."""
     cur = dbh.execute(
         "SELECT * FROM episodes WHERE castid = ? ORDER BY episodeid",
         ( pc.castid, ))
-    cols = map( lambda x: x[0], cur.description)
-    for row in cur.fetchall():
-        res.append( _convrow( Episode, cols, row, pc=pc))
-    return res
+    convert = _mapper( Episode, cur.description)
+    for row in _iter_rows( cur):
+        yield convert( row, pc)
+
+def get_all_pc_episodes( dbh, pc):
+    """Return a list of all episodes for one podcast."""
+    return list( iter_all_pc_episodes( dbh, pc))
+
+def iter_pending_episodes( dbh, podcasts=None, enabled_only=True):
+    """Yield the Pending episodes of the enabled podcasts, or of all podcasts
+    unless enabled_only, in castid and episodeid order as the rows arrive.
+    One query serves all podcasts, so that the cost is that of the pending
+    episodes, not of the history.
+    If podcasts is given, only episodes of those podcasts are returned,
+    each attached to its podcast object; otherwise all podcasts are read."""
+    if podcasts is None:
+        podcasts = get_all_podcasts( dbh)
+    by_castid = dict( ( pc.castid, pc) for pc in podcasts)
+    cur = dbh.execute( """SELECT episodes.* FROM episodes
+                          JOIN podcasts ON podcasts.castid = episodes.castid
+                          WHERE status = ? AND ( pcenabled = ? OR NOT ?)
+                          ORDER BY episodes.castid, episodeid""",
+                       ( EpisodeStatus.Pending.__str__(),
+                         PCEnabled.Enabled.index, enabled_only))
+    convert = _mapper( Episode, cur.description)
+    i = [ d[ 0] for d in cur.description].index( 'castid')
+    for row in _iter_rows( cur):
+        pc = by_castid.get( row[ i])
+        if pc is not None:
+            yield convert( row, pc)
+
+def iter_selected_pc_episodes( dbh, pc, wanted_ids):
+    """Yield selected episodes for one podcast, in episodeid order.
+    wanted_ids may hold IDs and ranges of them, which are looked up
+    together; see _select_ids."""
+    if (len( wanted_ids) == 0) or ( wanted_ids[0] == 'all'):
+        for ep in iter_all_pc_episodes( dbh, pc):
+            yield ep
+        return
+    for cur in _select_ids( dbh, """SELECT * FROM episodes
+                                    WHERE castid = ? AND ( {0})
+                                    ORDER BY episodeid""",
+                            ( pc.castid,), "episodeid", wanted_ids):
+        convert = _mapper( Episode, cur.description)
+        for row in _iter_rows( cur):
+            yield convert( row, pc)
 
 def get_selected_pc_episodes( dbh, pc, wanted_ids):
     """Return a list of selected episodes for one podcast."""
-    if (len( wanted_ids) == 0) or ( wanted_ids[0] == 'all'):
-        return get_all_pc_episodes( dbh, pc)
-    res = []
-    for epid, grp in groupby( sorted( wanted_ids)): # eliminates duplicates
-        cur = dbh.execute( """SELECT * FROM episodes
-                              WHERE castid = ? AND episodeid = ?""",
-                           ( pc.castid, epid))
-        cols = map( lambda x: x[0], cur.description)
-        row = cur.fetchone()
-        if row != None:
-            res.append( _convrow( Episode, cols, row, pc=pc))
-    return res
-
-def add_episode( dbh, ep): 
+    return list( iter_selected_pc_episodes( dbh, pc, wanted_ids))
+
+def add_episode( dbh, ep):
     """ Add a new episode.  Called to add episodes discovered by parsing the
-    feed -- typically the episode already exists in the db.  An episode is
-    considered to already exist if called with a non-empty epguid that matches
-    a database row, or if epguid is empty and epurl matches a database row.
+    feed -- typically the episode already exists in the db.  See add_episodes,
+    which this calls with just this one episode.
+      This function returns the number of inserted rows."""
+    return len( add_episodes( dbh, ep.podcast, [ ep])[ 0])
+
+
+def get_episode_keys( dbh, pc):
+    """Return a dict that maps the guids and the urls of the episodes of
+    podcast pc to their episodeids.  It is empty for a new podcast."""
+    keys = {}
+    for epid, guid, url in dbh.execute( """SELECT episodeid, epguid, epurl
+                                           FROM episodes WHERE castid = ?""",
+                                        ( pc.castid,)):
+        keys[ url] = epid
+        if guid:
+            keys[ guid] = epid
+    return keys
+
+
+def _run_batches( dbh, ops):
+    """Apply a list of ( sql, params) in order, handing each run of the same
+    statement to executemany"""
+    for sql, batch in groupby( ops, lambda op: op[0]):
+        dbh.executemany( sql, [ params for s, params in batch])
+
+
+_insert_episode_sql = """INSERT OR REPLACE INTO episodes
+                         ( castid, episodeid, title, epurl,
+                           enctype, status, eplength, epguid)
+                         VALUES ( ?, ?, ?, ?, ?, ?, ?, ?)"""
+
+_refresh_episode_sql = """UPDATE episodes
+                          SET    title=?, epurl=?, enctype=?, eplength=?,
+                                 epguid=COALESCE( ?, epguid)
+                          WHERE  castid==? AND episodeid==?"""
+
+def add_episodes( dbh, pc, eps):
+    """ Add the episodes discovered by parsing the feed of podcast pc, in
+    feed order.  Typically most of them already exist in the db.  An episode
+    is considered to already exist if its epguid or its epurl matches a
+    database row.
       If the episode already exists, update the row with values from the feed
     ( eptitle, epurl, epguid, enctype and eplength).
       Otherwise, generate a new unique epid and add a row to the episodes table.
-      The epid of the supplied episode instance is always modified to contain
+      The epid of each supplied episode instance is always modified to contain
     the epid of the db row.
-      This function returns the number of inserted rows."""
-
-    # This query is careful for cases where a feed may have two
-    # different episodes with different GUIDs but identical URLs.
-    # The db constraint allows for only one episodes row and that
-    # row will be found for either episode in the feed.  Thus we
-    # discard the earlier add request and overwrite it with info
-    # from the newer episode.
-    ids = dbh.execute( """SELECT episodeid FROM episodes
-                          WHERE castid == ? AND
-                                ( epguid == ? OR epurl == ? )""",
-                       ( ep.podcast.castid, ep.epguid, ep.epurl)).fetchall()
-
-    if len( ids) == 1:
-        # Existing episode
-        ep.episodeid = ids[ 0][ 0]
-        _d( "add_episode: exists id|guid|url: {0.episodeid}|{0.epguid}|{0.epurl}".format( ep))
-        dbh.execute( """UPDATE episodes
-                        SET    title=?, epurl=?, enctype=?, eplength=?
-                        WHERE  castid==? AND episodeid==?""",
-                     ( ep.title, ep.epurl, ep.enctype, ep.eplength, 
-                       ep.podcast.castid, ep.episodeid) )
-        rc = 0
-
-    elif len( ids) == 0:
-        # New episode, generate unique epid, set status to Pending
-        max_epid = dbh.execute( """SELECT MAX(episodeid) FROM episodes
-                                   WHERE castid = ?""",
-                                ( ep.podcast.castid,) ).fetchone()[0]
-        ep.episodeid = ( max_epid or 0) + 1
-        ep.epstatus = EpisodeStatus.Pending
-        _d( "add_episode: new id|guid|url: {0.episodeid}|{0.epguid}|{0.epurl}".format( ep))
-        dbh.execute( """INSERT OR REPLACE INTO episodes
-                        ( castid, episodeid, title, epurl,
-                          enctype, status, eplength)
-                        VALUES ( ?, ?, ?, ?, ?, ?, ?)""",
-                     ( ep.podcast.castid, ep.episodeid, ep.title, ep.epurl,
-                       ep.enctype, ep.epstatus.__str__(), ep.eplength) )
-        rc = 1
+      The podcast's existing guids and urls are read once and the episodes are
+    matched against them in memory, with the same results as adding them one
+    at a time; the changes are then written with executemany.  An existing
+    row is only written if the feed changed one of its values.  The caller
+    commits, so that a feed is applied in one transaction.
+      This function returns the list of the inserted episodes, and the numbers
+    of the other episodes whose rows were changed and left untouched."""
+
+    # A feed may have two different episodes with different GUIDs but
+    # identical URLs.  The db constraint allows for only one episodes row
+    # and that row will be found for either episode in the feed.  Thus we
+    # discard the earlier add request and overwrite it with info from the
+    # newer episode.
+    by_guid = {}    # epguid -> set of episodeids; NULL guids never match
+    by_url = {}     # epurl -> episodeid
+    rows = {}       # episodeid -> [ epguid, epurl, title, enctype, eplength]
+    max_epid = 0
+    for epid, guid, url, title, enctype, eplength in dbh.execute(
+            """SELECT episodeid, epguid, epurl, title, enctype, eplength
+               FROM episodes WHERE castid = ?""", ( pc.castid,)):
+        rows[ epid] = [ guid, url, title, enctype, eplength]
+        if guid is not None:
+            by_guid.setdefault( guid, set()).add( epid)
+        by_url[ url] = epid
+        max_epid = max( max_epid, epid)
+
+    ops = []
+    new = []
+    changed = untouched = 0
+    for ep in eps:
+        is_new = False
+        ids = set( by_guid.get( ep.epguid, ()))
+        if ep.epurl in by_url:
+            ids.add( by_url[ ep.epurl])
+
+        if len( ids) == 1:
+            # Existing episode
+            ep.episodeid = ids.pop()
+            _d( "add_episode: exists id|guid|url: {0.episodeid}|{0.epguid}|{0.epurl}".format( ep))
+            row = rows[ ep.episodeid]
+            stored = list( row)
+            if by_url.get( row[ 1]) == ep.episodeid:
+                del by_url[ row[ 1]]
+
+        elif len( ids) == 0:
+            # New episode, generate unique epid, set status to Pending
+            max_epid += 1
+            ep.episodeid = max_epid
+            ep.epstatus = EpisodeStatus.Pending
+            _d( "add_episode: new id|guid|url: {0.episodeid}|{0.epguid}|{0.epurl}".format( ep))
+            row = rows[ ep.episodeid] = [ None, None, None, None, None]
+            new.append( ep)
+            is_new = True
 
-    else:
-        # raise AssertionError( "Multiple epids match one episode")
-        _w( """AssertionError "Multiple epids match one episode"
+        else:
+            # raise AssertionError( "Multiple epids match one episode")
+            _w( """AssertionError "Multiple epids match one episode"
 Ignoring this conflicting new episode:
 {0!s}
 {0!r}
 ----------------------------------------""".format( ep))
-        return 0
+            continue
 
-    if ep.epguid == '':
         # ignore missing epguid
-        pass
-    else:
-        dbh.execute( """UPDATE episodes   SET epguid=?
-                        WHERE  castid==?  AND  episodeid==?""",
-                     ( ep.epguid, ep.podcast.castid, ep.episodeid) )
-    return rc
+        guid = ep.epguid if ep.epguid != '' else None
+        if guid is not None:
+            if row[ 0] is not None:
+                by_guid[ row[ 0]].discard( ep.episodeid)
+            by_guid.setdefault( guid, set()).add( ep.episodeid)
+            row[ 0] = guid
+        row[ 1:] = [ ep.epurl, ep.title, ep.enctype, ep.eplength]
+        by_url[ ep.epurl] = ep.episodeid
+
+        if is_new:
+            ops.append( ( _insert_episode_sql,
+                          ( pc.castid, ep.episodeid, ep.title, ep.epurl,
+                            ep.enctype, ep.epstatus.__str__(), ep.eplength,
+                            guid)))
+        elif row == stored:
+            untouched += 1
+        else:
+            changed += 1
+            ops.append( ( _refresh_episode_sql,
+                          ( ep.title, ep.epurl, ep.enctype, ep.eplength, guid,
+                            pc.castid, ep.episodeid)))
+    _run_batches( dbh, ops)
+    _d( "add_episodes: {0} new, {1} changed, {2} untouched".format(
+        len( new), changed, untouched))
+    return new, changed, untouched
 
 
 def update_episode( dbh, ep):
@@ -419,6 +688,36 @@ def update_episode( dbh, ep):
 
 ## --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  -- 
 
+def add_download( dbh, ep, filename, basename, mediatype, sha256, pristine):
+    """Record where a downloaded episode was stored.  basename is the name
+    of the file on the server and mediatype its content type; sha256 is the
+    hex digest of the file as downloaded.  pristine tells that the file is
+    not changed by a post-process command, so that it may share its disk
+    blocks with a later download of the same content."""
+    st = os.stat( filename)
+    dbh.execute( """INSERT OR REPLACE INTO downloads
+                    ( castid, episodeid, epurl, filename, basename, mediatype,
+                      length, mtime, sha256, pristine)
+                    VALUES ( ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                 ( ep.podcast.castid, ep.episodeid, ep.epurl, filename,
+                   basename, mediatype, st.st_size, int( st.st_mtime), sha256,
+                   int( bool( pristine))) )
+
+def get_pristine_downloads( dbh, epurl=None, sha256=None, castid=None):
+    """Return the rows of the downloads table for pristine files with the
+    given URL or content digest, excluding those of podcast castid.  Each
+    row is a dict keyed by column name; callers should check that the file
+    is still on disk with the recorded length and mtime before using it."""
+    cur = dbh.execute( """SELECT * FROM downloads
+                          WHERE pristine AND ( epurl == ? OR sha256 == ?)
+                                AND castid IS NOT ?
+                          ORDER BY castid, episodeid""",
+                       ( epurl, sha256, castid))
+    cols = map( lambda x: x[0], cur.description)
+    return [ dict( zip( cols, row)) for row in cur.fetchall()]
+
+## --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  -- 
+
 def test():
     "Test code to run when invoked on the command line"
     print( __doc__)
@@ -493,12 +792,39 @@ def test():
     n=add_episode( dbh, ep12)
     print( "add_episode inserts {0} rows for {1}".format( n, ep12))
 
+    print( "\n*** Add a feed's episodes to pc2 in one batch ...")
+    def feed():
+        return [ Episode( p2, 0, "ep2{0}title".format( i), url, guid,
+                          "audio/mpeg", EpisodeStatus.Pending, 100 * i)
+                 for i, ( url, guid) in enumerate( [ ( "u1", "g1"),
+                                                     ( "u1", "g2"),
+                                                     ( "u2", "")])]
+    # The second url u1 episode takes over the row of the first, so that row
+    # changes on every run; episode u2 is only written the first time
+    for expected, counts in ( ( [ 1, 2], ( 1, 0)), ( [], ( 2, 1))):
+        eps = feed()
+        new, changed, untouched = add_episodes( dbh, p2, eps)
+        print( ". new epids {0}, all epids {1}, {2} changed, {3} untouched"
+               .format( [ ep.episodeid for ep in new],
+                        [ ep.episodeid for ep in eps], changed, untouched))
+        if [ ep.episodeid for ep in new] != expected or \
+           [ ep.episodeid for ep in eps] != [ 1, 1, 2]:
+            raise AssertionError( "Batch did not match episodes one by one")
+        if ( changed, untouched) != counts:
+            raise AssertionError( "Unchanged episodes were written")
+    eps = feed()[ 1:]
+    print( ". the feed without its first episode leaves {0[2]} untouched"
+           .format( add_episodes( dbh, p2, eps)))
+    print( ". {0}".format( dbh.execute(
+        """SELECT episodeid, epguid, epurl, title FROM episodes
+           WHERE castid = ? ORDER BY episodeid""", ( p2.castid,)).fetchall()))
+
     print( "\n*** Change epstatus using update_episode ...")
     ep1.epstatus = EpisodeStatus.Downloaded
     update_episode( dbh, ep1)
 
     print( "\n*** Add episode to pc2 using update_episode ...")
-    ep2 = Episode( p2, 1, "ep21title", "ep21url", "", "application/mp3",
+    ep2 = Episode( p2, 99, "ep21title", "ep21url", "", "application/mp3",
                    EpisodeStatus.Pending, 2100)
     try:
         update_episode( dbh, ep2)
@@ -506,6 +832,15 @@ def test():
     except AssertionError as e:
         print( ". {0!r}".format( e))
 
+    print( "\n*** Record downloads, find pristine copies by URL or digest ...")
+    add_download( dbh, ep1, __file__, "db.py", "text/x-python", "d1", True)
+    add_download( dbh, ep12, __file__, "db.py", "text/x-python", "d2", False)
+    for kw in ( dict( epurl=ep1.epurl), dict( sha256="d1", castid=2),
+                dict( sha256="d1", castid=1), dict( epurl=ep12.epurl)):
+        rows = get_pristine_downloads( dbh, **kw)
+        print( ". {0}: {1}".format( kw, [ ( r[ "castid"], r[ "episodeid"])
+                                         for r in rows]))
+
     print( "\n*** Get selected (\"all\") podcasts ...")
     for p in get_selected_podcasts( dbh, ["all"]):
         print(". {0!s}".format( p))
@@ -538,6 +873,34 @@ def test():
     for e in get_selected_pc_episodes( dbh, pc, [ 0, 2, 4, 6]):
         print( str( e))
 
+    print( "\n*** Pending episodes of enabled podcasts ...")
+    pending = list( iter_pending_episodes( dbh))
+    for e in pending:
+        print( ". {0}".format( e))
+    if [ ( e.podcast.castid, e.episodeid) for e in pending] != [ ( 2, 1),
+                                                                 ( 2, 2)]:
+        raise AssertionError( "Wrong pending episodes")
+    plan = [ tuple( row) for row in dbh.execute(
+        """EXPLAIN QUERY PLAN SELECT * FROM episodes
+           WHERE status = 'Pending'""")]
+    print( ". plan: {0}".format( plan))
+    if "episodes_status" not in "{0}".format( plan):
+        raise AssertionError( "The status index is not used")
+
+    print( "\n*** ID ranges of [ 3, '1', '2', '7-9', '8-12', '20-', 'x', '9-5']")
+    ranges = _id_ranges( [ 3, '1', '2', '7-9', '8-12', '20-', 'x', '9-5'])
+    print( ". {0}".format( ranges))
+    if ranges != [ [ 1, 3], [ 7, 12], [ 20, _max_id]]:
+        raise AssertionError( "ID ranges were not merged")
+
+    print( "\n*** Selected [ '2-', '-1', '1'] episodes from podcast 2 ...")
+    pc.castid = 2
+    eps = get_selected_pc_episodes( dbh, pc, [ '2-', '-1', '1'])
+    for e in eps:
+        print( str( e))
+    if [ e.episodeid for e in eps] != [ 1, 2]:
+        raise AssertionError( "Open ID ranges did not select episodes")
+
     print( "\n*** Remove podcast #1 ...")
     remove_podcast( dbh, p1)
 
@@ -555,6 +918,61 @@ def test():
 
     print( "***database test complete")
 
+    benchmark()
+
+
+def _convrow_by_column( T, cols, row, pc=None):
+    "Convert a row column by column, as before row mappers; for benchmark()"
+    mbrs = {}
+    for i, c in enumerate( cols):
+        if c == 'pcenabled':
+            mbrs[ c] = PCEnabled[ row[ i]]
+        elif c == 'status':
+            mbrs[ 'epstatus'] = string_to_enum( row[ i], EpisodeStatus)
+        elif T == Episode and c == 'castid':
+            mbrs[ 'podcast'] = pc
+        elif c in ( 'epguid', 'etag', 'lastmodified', 'bodyhash') and \
+             not row[ i]:
+            mbrs[ c] = ''
+        else:
+            mbrs[ c] = row[ i]
+    return T( **mbrs)
+
+def benchmark( n=20000):
+    """Time reading n episodes of one podcast, converting the rows column by
+    column into Episodes, and with a row mapper"""
+    print( "\n*** Benchmark: read {0} episodes ...".format( n))
+    dbh = connect( ":memory:")
+    pc = Podcast( 'URL', 0, 'bench')
+    add_podcast( dbh, pc)
+    dbh.executemany( """INSERT INTO episodes
+                        ( castid, episodeid, title, epurl, epguid, enctype,
+                          status, eplength) VALUES ( ?, ?, ?, ?, ?, ?, ?, ?)""",
+                     [ ( pc.castid, i, "title {0}".format( i),
+                         "url{0}".format( i), "guid{0}".format( i),
+                         "audio/mpeg", str( EpisodeStatus[ i % 4]), 1000 * i)
+                       for i in range( n)])
+    dbh.commit()
+
+    def by_column():
+        cur = dbh.execute( """SELECT * FROM episodes WHERE castid = ?
+                              ORDER BY episodeid""", ( pc.castid,))
+        cols = [ d[ 0] for d in cur.description]
+        return [ _convrow_by_column( Episode, cols, row, pc) for row in cur]
+
+    rates = []
+    for name, read in ( ( "column by column", by_column),
+                        ( "row mapper", lambda: get_all_pc_episodes( dbh, pc))):
+        start = time.time()
+        eps = read()
+        seconds = time.time() - start
+        rates.append( len( eps) / seconds)
+        print( ". {0:<16} {1:>9.0f} rows/s".format( name, rates[ -1]))
+        if len( eps) != n or eps[ 1].epstatus != EpisodeStatus.Downloaded:
+            raise AssertionError( "Episodes were not read back")
+    print( ". speedup {0:.1f}x".format( rates[ 1] / rates[ 0]))
+    disconnect( dbh)
+
 
 if __name__ == '__main__':
     # Run test code when invoked on the command line
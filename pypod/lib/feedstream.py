@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026, Robert N. Evans
+
+#
+# PyPod - A podcast media aggregator.  This program is a re-implementation
+# of John Goerzen's no longer supported hpodder utility.
+#
+# PyPod is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPod is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""This file implements incremental feed parsing.  The items of an RSS 2.0
+or Atom feed are read one at a time with a streaming XML parser, keeping only
+the fields that update needs, so that reading a long feed can stop as soon as
+the rest of it is known."""
+
+# standard library imports
+from __future__ import print_function, unicode_literals
+from io import BytesIO
+import logging
+import sys
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+try:
+    str = unicode
+except NameError:
+    pass
+
+
+__author__    = "Robert N. Evans <http://home.earthlink.net/~n1be/>"
+__copyright__ = "Copyright (C) 2026 {0}. All rights reserved.".format( __author__)
+__date__      = "2026-10-17"
+__license__   = "GPLv3"
+__version__   = "0.1"
+
+
+def _d( msg):
+    "Print debugging messages"
+    logging.debug( "feedstream: " + str( msg))
+
+
+_atom = "{http://www.w3.org/2005/Atom}"
+
+_roots = ( "rss", _atom + "feed")
+_channels = ( "channel", _atom + "feed")
+_items = ( "item", _atom + "entry")
+_titles = ( "title", _atom + "title")
+_ids = ( "guid", _atom + "id")
+
+
+class _FeedDict( dict):
+    """A dict whose keys can also be read as attributes, like the results
+    of feedparser"""
+
+    def __getattr__( self, key):
+        try:
+            return self[ key]
+        except KeyError:
+            raise AttributeError( key)
+
+    __setattr__ = dict.__setitem__
+
+
+def _text( elem):
+    "All the text in elem, including that of an Atom xhtml div"
+    return str( "".join( elem.itertext()))
+
+
+def _enclosure( href, type, length):
+    """An enclosure with the attributes that are present.  The parser returns
+    ASCII values as byte strings; they are made unicode like the others."""
+    encl = _FeedDict()
+    for key, value in ( ( "href", href), ( "type", type),
+                        ( "length", length)):
+        if value is not None:
+            encl[ key] = str( value)
+    return encl
+
+
+def parse_feed( content, stop=None):
+    """Parse the feed in the bytes content.  Returns a result shaped like
+    that of feedparser.parse, with the feed title and, for each item, its
+    title, id ( RSS guid or Atom id) and enclosures, in document order.
+      stop is called with each item as it is complete; if it returns True,
+    parsing ends there and the result has truncated set.
+      Returns None if content is not well formed RSS 2.0 or Atom, so that
+    the caller can fall back to feedparser."""
+    d = _FeedDict( bozo=0, feed=_FeedDict(), entries=[], truncated=False)
+    path = []
+    item = None
+    try:
+        for event, elem in ElementTree.iterparse( BytesIO( content),
+                                                  events=( b"start", b"end")):
+            tag = elem.tag
+            if event == b"start":
+                if not path and tag not in _roots:
+                    _d( "not RSS 2.0 or Atom: {0}".format( tag))
+                    return None
+                path.append( tag)
+                if tag in _items:
+                    item = _FeedDict()
+                continue
+            path.pop()
+            parent = path[ -1] if path else None
+            if tag in _items:
+                d.entries.append( item)
+                item = None
+                elem.clear()
+                if stop and stop( d.entries[ -1]):
+                    _d( "stopped after {0} items".format( len( d.entries)))
+                    d.truncated = True
+                    break
+            elif item is None:
+                if tag in _titles and parent in _channels:
+                    d.feed.title = _text( elem)
+            elif parent in _items:
+                if tag in _titles:
+                    item.title = _text( elem)
+                elif tag in _ids:
+                    item.id = _text( elem)
+                elif tag == "enclosure":
+                    item.setdefault( "enclosures", []).append( _enclosure(
+                        elem.get( "url"), elem.get( "type"),
+                        elem.get( "length")))
+                elif tag == _atom + "link" and \
+                     elem.get( "rel") == "enclosure":
+                    item.setdefault( "enclosures", []).append( _enclosure(
+                        elem.get( "href"), elem.get( "type"),
+                        elem.get( "length")))
+    except SyntaxError as e:
+        # ParseError, including encodings that expat does not know
+        _d( "not well formed: {0}".format( e))
+        return None
+    return d
+
+## --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --
+
+_sample_rss = b"""<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0"><channel><title>Show &amp; Tell</title>
+<image><title>Not the title</title></image>
+<item><title>Three</title><guid isPermaLink="false">g3</guid>
+  <description>Long show notes</description>
+  <enclosure url="http://x/3a.mp3" length="300" type="audio/mpeg"/>
+  <enclosure url="http://x/3b.mp3"/></item>
+<item><title><![CDATA[Two <i>x</i>]]></title><guid>g2</guid>
+  <enclosure url="http://x/2.mp3" length="200" type="audio/mpeg"/></item>
+<item><title>One</title>
+  <enclosure url="http://x/1.mp3" type="audio/mpeg"/></item>
+</channel></rss>"""
+
+_sample_atom = b"""<feed xmlns="http://www.w3.org/2005/Atom">
+<title type="html">Atom &amp;amp; Eve</title><id>urn:feed</id>
+<entry><title>Two</title><id>urn:2</id>
+  <link rel="enclosure" href="http://x/2.m4a" type="audio/mp4" length="5"/>
+  <link href="http://x/page2"/></entry>
+<entry><title>One</title><id>urn:1</id>
+  <source><title>Elsewhere</title></source>
+  <link rel="enclosure" href="http://x/1.m4a" type="audio/mp4"/></entry>
+</feed>"""
+
+
+def _summary( d):
+    "The fields of a parsed feed that update uses"
+    return ( d.feed.get( "title"),
+             [ ( e.get( "title"), e.get( "id"),
+                 [ sorted( encl.items()) for encl in e.get( "enclosures", [])])
+               for e in d.entries])
+
+
+def test():
+    "Test code to run when invoked on the command line"
+    print( __doc__)
+    print()
+    import feedparser
+    for name, content in ( ( "RSS", _sample_rss), ( "Atom", _sample_atom)):
+        got = _summary( parse_feed( content))
+        print( "{0}: {1}".format( name, got))
+        if got != _summary( feedparser.parse( content)):
+            raise AssertionError( "{0} differs from feedparser".format( name))
+    d = parse_feed( _sample_rss, stop=lambda item: item.id == "g2")
+    print( "stop at g2: {0} items, truncated {1}".format( len( d.entries),
+                                                         d.truncated))
+    if len( d.entries) != 2 or not d.truncated:
+        raise AssertionError( "Parsing did not stop")
+    for content in ( b"<rss><channel><item>", b"<rdf:RDF xmlns:rdf="
+                     b"'http://www.w3.org/1999/02/22-rdf-syntax-ns#'/>"):
+        if parse_feed( content) is not None:
+            raise AssertionError( "Accepted {0!r}".format( content))
+    print( "\n   DONE.")
+
+if __name__ == '__main__':
+    # Run test code when invoked on the command line
+    sys.exit( test())
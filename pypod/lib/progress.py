@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026, Robert N. Evans
+
+#
+# PyPod - A podcast media aggregator.  This program is a re-implementation
+# of John Goerzen's no longer supported hpodder utility.
+#
+# PyPod is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPod is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""This file implements the download progress meter.  Each transfer only
+bumps a byte counter; a watcher thread samples all in-flight transfers every
+progressinterval seconds and reports them, as watchTheFiles did in hpodder."""
+
+# standard library imports
+from __future__ import print_function, unicode_literals
+import sys
+import threading
+import time
+try:
+    str = unicode
+except NameError:
+    pass
+
+
+__author__    = "Robert N. Evans <http://home.earthlink.net/~n1be/>"
+__copyright__ = "Copyright (C) 2026 {0}. All rights reserved.".format( __author__)
+__date__      = "2026-10-17"
+__license__   = "GPLv3"
+__version__   = "0.1"
+
+
+_terse_interval = 60    # Minimum seconds between reports when not on a tty
+_smoothing = 0.3        # Weight of the newest sample in transfer rates
+
+
+def _fmt_size( n):
+    "Format a byte count with a binary unit suffix"
+    for unit in ( '', 'K', 'M', 'G'):
+        if n < 1024:
+            break
+        n /= 1024.0
+    else:
+        unit = 'T'
+    if unit:
+        return "{0:.1f}{1}".format( n, unit)
+    return "{0}".format( int( n))
+
+
+def _fmt_secs( s):
+    "Format a number of seconds as [h:]mm:ss"
+    if s is None:
+        return "--:--"
+    m, s = divmod( int( s), 60)
+    h, m = divmod( m, 60)
+    if h:
+        return "{0}:{1:02d}:{2:02d}".format( h, m, s)
+    return "{0:02d}:{1:02d}".format( m, s)
+
+
+class Transfer( object):
+    """Progress of one download.  Only the thread doing the transfer
+    writes to it; the meter only reads the counters."""
+
+    def __init__( self, name, total=None):
+        self.name = name
+        self.total = total      # Expected size in bytes, if known
+        self.received = 0       # Bytes on disk, including a resumed part
+        self.rate = None        # Smoothed bytes per second
+        self._last = None       # ( time, received) at the previous sample
+
+    def _sample( self, now):
+        "Update the transfer rate; return bytes received since last sample"
+        if self._last is None:
+            self._last = ( now, self.received)
+            return 0
+        then, before = self._last
+        self._last = ( now, self.received)
+        got = self.received - before
+        if now > then:
+            rate = got / ( now - then)
+            if self.rate is None:
+                self.rate = rate
+            else:
+                self.rate += _smoothing * ( rate - self.rate)
+        return got
+
+    @property
+    def eta( self):
+        "Estimated seconds until done, or None"
+        if not self.total or not self.rate:
+            return None
+        return max( 0, self.total - self.received) / self.rate
+
+    def __str__( self):
+        if self.total:
+            pct = "{0:3d}%".format( min( 100, 100 * self.received // self.total))
+        else:
+            pct = _fmt_size( self.received)
+        return "{0} {1} {2}/s {3}".format( self.name, pct,
+                                           _fmt_size( self.rate or 0),
+                                           _fmt_secs( self.eta))
+
+
+class ProgressMeter( object):
+    """Report the progress of all registered transfers every interval
+    seconds, from a background thread.  On a terminal one status line is
+    redrawn in place; otherwise (e.g. under cron) a plain summary line is
+    printed no more than once every _terse_interval seconds."""
+
+    def __init__( self, interval, stream=None):
+        self.interval = interval
+        self.stream = stream or sys.stdout
+        self.tty = self.stream.isatty()
+        self.done_bytes = 0     # Bytes received by transfers now finished
+        self.done_count = 0
+        self._transfers = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_report = 0
+        self._drawn = False
+
+    def add( self, transfer):
+        "Start reporting a transfer"
+        with self._lock:
+            self._transfers.append( transfer)
+
+    def remove( self, transfer):
+        "Stop reporting a finished transfer"
+        with self._lock:
+            self._transfers.remove( transfer)
+            self.done_bytes += transfer.received
+            self.done_count += 1
+
+    @property
+    def received( self):
+        "Bytes received by all transfers, finished or not"
+        with self._lock:
+            return self.done_bytes + sum( t.received for t in self._transfers)
+
+    def start( self):
+        "Start the watcher thread, unless progress reports are turned off"
+        if self.interval <= 0:
+            return
+        self._last_report = time.time()
+        self._thread = threading.Thread( target=self._run, name="progress")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop( self):
+        "Stop the watcher thread and clear the status line"
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.clear()
+
+    def clear( self):
+        "Erase the status line, if one is drawn"
+        if self._drawn:
+            self.stream.write( "\r\033[K")
+            self.stream.flush()
+            self._drawn = False
+
+    def _run( self):
+        while not self._stop.wait( self.interval):
+            self.report()
+
+    def report( self):
+        "Sample every transfer and print one status line"
+        now = time.time()
+        with self._lock:
+            transfers = list( self._transfers)
+        rate = 0
+        active = 0
+        remaining = 0
+        for t in transfers:
+            t._sample( now)
+            rate += t.rate or 0
+            active += t.received
+            if t.total:
+                remaining += max( 0, t.total - t.received)
+        if not transfers:
+            return
+        eta = rate and remaining / rate or None
+        total = "total {0} {1}/s {2}, {3} done".format(
+            _fmt_size( self.done_bytes + active), _fmt_size( rate),
+            _fmt_secs( eta), self.done_count)
+        if self.tty:
+            line = " | ".join( [ str( t) for t in transfers] + [ total])
+            self.stream.write( "\r\033[K" + line[ :159])
+            self._drawn = True
+        elif now - self._last_report >= max( self.interval, _terse_interval):
+            self.stream.write( "Progress: {0} active, {1}\n"
+                               .format( len( transfers), total))
+        else:
+            return
+        self._last_report = now
+        self.stream.flush()
+
+## --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --
+
+def test():
+    "Test code to run when invoked on the command line"
+    print( __doc__)
+    print()
+    for n in ( 0, 1023, 1024, 1536, 5 * 1024 * 1024, 3 << 40):
+        print( "_fmt_size( {0}) = {1}".format( n, _fmt_size( n)))
+    for s in ( None, 5, 65, 3725):
+        print( "_fmt_secs( {0}) = {1}".format( s, _fmt_secs( s)))
+    print()
+    meter = ProgressMeter( 0.2)
+    a = Transfer( "1.1", 1000000)
+    b = Transfer( "2.7")
+    meter.add( a)
+    meter.add( b)
+    meter.start()
+    for i in range( 10):
+        time.sleep( 0.1)
+        a.received += 50000
+        b.received += 20000
+    meter.remove( a)
+    time.sleep( 0.3)
+    meter.stop()
+    print( "done_count = {0}, done_bytes = {1}".format(
+        meter.done_count, meter.done_bytes))
+    print( str( b))
+
+if __name__ == '__main__':
+    # Run test code when invoked on the command line
+    sys.exit( test())
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026, Robert N. Evans
+
+#
+# PyPod - A podcast media aggregator.  This program is a re-implementation
+# of John Goerzen's no longer supported hpodder utility.
+#
+# PyPod is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPod is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""This file implements download scheduling: the order in which pending
+episodes are downloaded, and the time and byte budgets that decide whether a
+transfer may still be started."""
+
+# standard library imports
+from __future__ import print_function, unicode_literals
+from collections import namedtuple
+import itertools
+import logging
+import sys
+import threading
+import time
+try:
+    str = unicode
+except NameError:
+    pass
+
+
+__author__    = "Robert N. Evans <http://home.earthlink.net/~n1be/>"
+__copyright__ = "Copyright (C) 2026 {0}. All rights reserved.".format( __author__)
+__date__      = "2026-10-17"
+__license__   = "GPLv3"
+__version__   = "0.1"
+
+
+def _d( msg):
+    "Print debugging messages"
+    logging.debug( "sched: " + str( msg))
+
+
+def _by_recency( episodes):
+    """Newest first.  Episode IDs grow as episodes are found, but they are
+    numbered per podcast, so the episodes are ranked by how many newer ones
+    their podcast has; podcasts then take turns at each rank."""
+    newer = {}      # castid -> number of its episodes ranked so far
+    rank = {}
+    for ep in sorted( episodes, key=lambda e: -e.episodeid):
+        castid = ep.podcast.castid
+        rank[ id( ep)] = newer.get( castid, 0)
+        newer[ castid] = rank[ id( ep)] + 1
+    return sorted( episodes, key=lambda e: rank[ id( e)])
+
+
+def _by_size( episodes):
+    "Smallest first; episodes of unknown length go last"
+    return sorted( episodes, key=lambda e: ( not e.eplength, e.eplength))
+
+
+def _round_robin( episodes):
+    "Podcasts take turns, each with its episodes in feed order"
+    queues = []
+    for castid, eps in itertools.groupby( episodes,
+                                          lambda e: e.podcast.castid):
+        queues.append( list( eps))
+    order = []
+    for turn in itertools.izip_longest( *queues):
+        order.extend( ep for ep in turn if ep is not None)
+    return order
+
+
+_policies = {
+    "feed": list,
+    "newest": _by_recency,
+    "smallest": _by_size,
+    "roundrobin": _round_robin,
+}
+
+order_names = sorted( _policies)
+
+
+def order_episodes( episodes, policy):
+    """Return the episodes in the order given by the named policy.  The
+    episodes must come grouped by podcast, in feed order, as they are read
+    from the database."""
+    try:
+        return _policies[ policy.strip().lower()]( episodes)
+    except KeyError:
+        raise ValueError( "Unknown download order '{0}', expected one of {1}"
+                          .format( policy, ", ".join( order_names)))
+
+
+def _parse_number( text, units, what):
+    "Parse text as a number with an optional unit suffix from units"
+    text = text.strip().lower()
+    factor = 1
+    if text and text[-1] in units:
+        text, factor = text[:-1], units[ text[-1]]
+    try:
+        value = float( text) * factor
+    except ValueError:
+        raise ValueError( "Invalid {0}: '{1}'".format( what, text))
+    if value < 0:
+        raise ValueError( "Invalid {0}: '{1}'".format( what, text))
+    return value
+
+
+def parse_duration( text):
+    "Parse a duration in seconds, or with an s, m, h or d suffix"
+    return _parse_number( text, { "s": 1, "m": 60, "h": 3600, "d": 86400},
+                          "duration")
+
+
+def parse_size( text):
+    "Parse a size in bytes, or with a K, M or G (binary) suffix"
+    return int( _parse_number( text, { "k": 1 << 10, "m": 1 << 20,
+                                       "g": 1 << 30}, "size"))
+
+
+def add_schedule_options( parser):
+    "Add the options that order and limit downloads to an OptionParser"
+    parser.add_option( "--order", dest="order", metavar="POLICY",
+                       help="Download order, one of {0}; overrides the "
+                            "downloadorder option".format(
+                                ", ".join( order_names)))
+    parser.add_option( "--time-budget", dest="time_budget", metavar="TIME",
+                       help="Start no transfer that is not expected to be "
+                            "done within TIME seconds (or add m or h)")
+    parser.add_option( "--byte-budget", dest="byte_budget", metavar="SIZE",
+                       help="Start no transfer that would bring the total "
+                            "downloaded over SIZE bytes (or add K, M or G)")
+
+
+def schedule_args( options):
+    "Turn the options added by add_schedule_options back into arguments"
+    args = []
+    for opt, value in ( ( "--order", options.order),
+                        ( "--time-budget", options.time_budget),
+                        ( "--byte-budget", options.byte_budget)):
+        if value is not None:
+            args.extend( [ opt, value])
+    return args
+
+
+class Budget( object):
+    """Limit a run of downloads to a wall-clock time and a number of bytes.
+    A transfer is only started if, at the throughput observed so far, it can
+    finish in the time left behind all the transfers started before it, and
+    if its length fits in the bytes left.  Episodes of unknown length are
+    started while any budget is left.
+      admit() is called by the worker threads as they are about to start a
+    transfer; received is a callable returning the number of bytes received
+    so far by this run."""
+
+    _warmup = 2     # Seconds of transfers before throughput is trusted
+
+    def __init__( self, seconds=None, nbytes=None, received=None):
+        self.seconds = seconds
+        self.nbytes = nbytes
+        self._received = received or ( lambda: 0)
+        self._start = time.time()
+        self._committed = 0     # Bytes of the transfers admitted so far
+        self._lock = threading.Lock()
+
+    def admit( self, length):
+        "Tell whether a transfer of length bytes ( 0 if unknown) may start"
+        with self._lock:
+            if self.nbytes is not None:
+                if self._committed + length > self.nbytes or \
+                   self._committed >= self.nbytes:
+                    return False
+            if self.seconds is not None:
+                elapsed = time.time() - self._start
+                left = self.seconds - elapsed
+                if left <= 0:
+                    return False
+                received = self._received()
+                if elapsed >= self._warmup and received > 0:
+                    rate = received / elapsed
+                    ahead = max( 0, self._committed - received)
+                    need = ( ahead + length) / rate
+                    _d( "{0} B at {1:.0f} B/s: {2:.0f} s needed, {3:.0f} s "
+                        "left".format( ahead + length, rate, need, left))
+                    if need > left:
+                        return False
+            self._committed += length
+            return True
+
+    def settle( self, length, actual):
+        "Correct the bytes committed for a transfer once its size is known"
+        with self._lock:
+            self._committed += actual - length
+
+## --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --
+
+def test():
+    "Test code to run when invoked on the command line"
+    print( __doc__)
+    print()
+    Pc = namedtuple( "Pc", "castid")
+    Ep = namedtuple( "Ep", "podcast episodeid eplength")
+    a, b = Pc( 1), Pc( 2)
+    eps = [ Ep( a, 1, 900), Ep( a, 2, 0), Ep( a, 3, 100), Ep( a, 4, 50),
+            Ep( b, 1, 300), Ep( b, 2, 200)]
+    for name in order_names:
+        order = order_episodes( eps, name)
+        print( "{0:10} {1}".format( name, " ".join(
+            "{0.podcast.castid}.{0.episodeid}".format( e) for e in order)))
+    print()
+    for text in ( "90", "45m", "2h", "7d"):
+        print( "parse_duration( {0}) = {1}".format( text,
+                                                    parse_duration( text)))
+    for text in ( "1000", "64K", "1.5G"):
+        print( "parse_size( {0}) = {1}".format( text, parse_size( text)))
+    print()
+    budget = Budget( nbytes=1000)
+    got = [ budget.admit( n) for n in ( 600, 500, 300, 0, 200)]
+    print( "byte budget 1000 admits 600 500 300 0 200: {0}".format( got))
+    if got != [ True, False, True, True, False]:
+        raise AssertionError( "Byte budget was not honored")
+    budget = Budget( seconds=60, received=lambda: 1000)
+    budget._start -= 10     # 100 B/s observed, 50 s left
+    got = [ budget.admit( n) for n in ( 4000, 2000)]
+    print( "time budget with 50 s left at 100 B/s admits 4000 2000: {0}"
+           .format( got))
+    if got != [ True, False]:
+        raise AssertionError( "Time budget was not honored")
+    print( "\n   DONE.")
+
+if __name__ == '__main__':
+    # Run test code when invoked on the command line
+    sys.exit( test())
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026, Robert N. Evans
+
+#
+# PyPod - A podcast media aggregator.  This program is a re-implementation
+# of John Goerzen's no longer supported hpodder utility.
+#
+# PyPod is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPod is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""This file implements content type sniffing.  The first few KB of a
+downloaded file are matched against the magic numbers of the formats that
+podcasts use, so that most files are classified without running the
+external gettypecommand."""
+
+# standard library imports
+from __future__ import print_function, unicode_literals
+import sys
+try:
+    str = unicode
+except NameError:
+    pass
+
+
+__author__    = "Robert N. Evans <http://home.earthlink.net/~n1be/>"
+__copyright__ = "Copyright (C) 2026 {0}. All rights reserved.".format( __author__)
+__date__      = "2026-10-17"
+__license__   = "GPLv3"
+__version__   = "0.1"
+
+
+sniff_size = 4096   # Bytes from the start of a file that sniff() looks at
+
+
+# ISO base media file ( MP4) brands -> media type
+_mp4_brands = {
+    b"M4A ": "audio/mp4",
+    b"M4B ": "audio/mp4",
+    b"M4P ": "audio/mp4",
+    b"F4A ": "audio/mp4",
+    b"M4V ": "video/x-m4v",
+    b"M4VH": "video/x-m4v",
+    b"M4VP": "video/x-m4v",
+    b"qt  ": "video/quicktime",
+    b"3gp4": "video/3gpp",
+    b"3gp5": "video/3gpp",
+    b"3gp6": "video/3gpp",
+}
+
+# Simple prefixes -> media type, tried in order
+_prefixes = [
+    ( b"ID3", "audio/mpeg"),
+    ( b"%PDF-", "application/pdf"),
+    ( b"fLaC", "audio/flac"),
+    ( b"#!AMR", "audio/amr"),
+    ( b"\x30\x26\xb2\x75\x8e\x66\xcf\x11", "video/x-ms-asf"),
+    ( b"\xff\xd8\xff", "image/jpeg"),
+    ( b"\x89PNG\r\n\x1a\n", "image/png"),
+    ( b"GIF8", "image/gif"),
+    ( b"PK\x03\x04", "application/zip"),
+]
+
+
+def _sniff_ogg( head):
+    "Classify an Ogg stream by the codec of its first page"
+    if b"OpusHead" in head:
+        return "audio/opus"
+    if b"\x01vorbis" in head or b"FLAC" in head or b"Speex" in head:
+        return "audio/ogg"
+    if b"\x80theora" in head:
+        return "video/ogg"
+    return "application/ogg"
+
+
+def _sniff_mpeg_audio( head):
+    """Classify a bare MPEG audio frame header: an MP3 frame, or an ADTS AAC
+    frame.  Returns None for bytes that only look like a frame sync."""
+    if len( head) < 4:
+        return None
+    b1, b2 = ord( head[1:2]), ord( head[2:3])
+    if ord( head[0:1]) != 0xff or b1 & 0xe0 != 0xe0:
+        return None
+    if b1 & 0x06 == 0:      # Layer bits 00: ADTS
+        if b1 & 0x10 and ( b2 >> 2) & 0x0f < 13:
+            return "audio/aac"
+        return None
+    if b1 & 0x18 == 0x08:   # Reserved version
+        return None
+    if b2 >> 4 in ( 0, 15) or b2 & 0x0c == 0x0c:   # Bad bit or sample rate
+        return None
+    return "audio/mpeg"
+
+
+def sniff( head):
+    """Return the media type of a file that starts with the bytes head, or
+    None if it is not recognized."""
+    for prefix, type in _prefixes:
+        if head.startswith( prefix):
+            return type
+    if head.startswith( b"OggS"):
+        return _sniff_ogg( head)
+    if head[4:8] == b"ftyp":
+        return _mp4_brands.get( head[8:12], "video/mp4")
+    if head[4:8] in ( b"moov", b"mdat", b"wide", b"free"):
+        return "video/quicktime"
+    if head.startswith( b"RIFF"):
+        return { b"WAVE": "audio/x-wav",
+                 b"AVI ": "video/x-msvideo"}.get( head[8:12])
+    if head.startswith( b"\x1a\x45\xdf\xa3"):
+        if b"webm" in head[:64]:
+            return "video/webm"
+        return "video/x-matroska"
+    type = _sniff_mpeg_audio( head)
+    if type:
+        return type
+    # A web page instead of media, e.g. from a login or error redirect
+    text = head.lstrip()[:256].lower()
+    if text.startswith( b"<!doctype html") or text.startswith( b"<html"):
+        return "text/html"
+    if text.startswith( b"<?xml") or text.startswith( b"<rss"):
+        return "text/xml"
+    return None
+
+
+def sniff_file( path):
+    "Return the media type of the named file according to sniff(), or None"
+    with open( path, 'rb') as f:
+        return sniff( f.read( sniff_size))
+
+## --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --
+
+def test():
+    "Test code to run when invoked on the command line"
+    print( __doc__)
+    print()
+    samples = [
+        ( b"ID3\x04\x00\x00\x00\x00\x00\x00", "audio/mpeg"),
+        ( b"\xff\xfb\x90\x64\x00\x00", "audio/mpeg"),
+        ( b"\xff\xf1\x50\x80\x02\x1f", "audio/aac"),
+        ( b"\x00\x00\x00\x20ftypM4A \x00\x00\x00\x00", "audio/mp4"),
+        ( b"\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00", "video/mp4"),
+        ( b"\x00\x00\x00\x18ftypM4V \x00\x00\x00\x00", "video/x-m4v"),
+        ( b"OggS\x00\x02" + b"\x00" * 22 + b"OpusHead", "audio/opus"),
+        ( b"OggS\x00\x02" + b"\x00" * 23 + b"\x01vorbis", "audio/ogg"),
+        ( b"%PDF-1.4\n", "application/pdf"),
+        ( b"RIFF\x00\x00\x00\x00WAVEfmt ", "audio/x-wav"),
+        ( b"\n  <!DOCTYPE html><html>", "text/html"),
+        ( b"\xff\xd8\xff\xe0", "image/jpeg"),
+        ( b"\xff\xff\xff\xff", None),
+        ( b"plain text", None),
+        ( b"", None),
+    ]
+    for head, expected in samples:
+        got = sniff( head)
+        print( "{0!r:40} -> {1}".format( head[:20], got))
+        if got != expected:
+            raise AssertionError( "expected {0}".format( expected))
+    print( "\n   DONE.")
+
+if __name__ == '__main__':
+    # Run test code when invoked on the command line
+    sys.exit( test())
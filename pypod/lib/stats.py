@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026, Robert N. Evans
+
+#
+# PyPod - A podcast media aggregator.  This program is a re-implementation
+# of John Goerzen's no longer supported hpodder utility.
+#
+# PyPod is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPod is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""This file implements timing instrumentation.  Once enabled, the time
+spent in each phase of a run, such as connecting, transferring or parsing,
+is added up per phase, per podcast and per host, for a report at the end of
+the run, along with counts of events such as reused connections.  Timings
+are taken on any thread; those taken within podcast() are charged to that
+podcast."""
+
+# standard library imports
+from __future__ import print_function, unicode_literals
+from contextlib import contextmanager
+import json
+import sys
+import threading
+import time
+try:
+    str = unicode
+except NameError:
+    pass
+
+
+__author__    = "Robert N. Evans <http://home.earthlink.net/~n1be/>"
+__copyright__ = "Copyright (C) 2026 {0}. All rights reserved.".format( __author__)
+__date__      = "2026-10-17"
+__license__   = "GPLv3"
+__version__   = "0.1"
+
+
+_enabled = False
+_lock = threading.Lock()
+_local = threading.local()      # castid, the podcast being worked on
+_phases = {}                    # phase -> [ count, seconds]
+_podcasts = {}                  # castid -> { phase -> [ count, seconds]}
+_hosts = {}                     # host -> { phase -> [ count, seconds]}
+_counters = {}                  # event -> count
+
+
+def enable():
+    "Start recording timings"
+    global _enabled
+    _enabled = True
+
+
+def enabled():
+    "Tell whether timings are recorded"
+    return _enabled
+
+
+@contextmanager
+def podcast( castid):
+    "Charge the timings taken on this thread within the block to castid"
+    outer = getattr( _local, 'castid', None)
+    _local.castid = castid
+    try:
+        yield
+    finally:
+        _local.castid = outer
+
+
+def _tally( table, phase, seconds):
+    "Add one timing of phase to table"
+    entry = table.setdefault( phase, [ 0, 0.0])
+    entry[ 0] += 1
+    entry[ 1] += seconds
+
+
+def add( phase, seconds, host=None):
+    "Record that phase took seconds, for host if it is about one"
+    if not _enabled:
+        return
+    castid = getattr( _local, 'castid', None)
+    with _lock:
+        _tally( _phases, phase, seconds)
+        if castid is not None:
+            _tally( _podcasts.setdefault( castid, {}), phase, seconds)
+        if host:
+            _tally( _hosts.setdefault( host, {}), phase, seconds)
+
+
+def count( event, n=1):
+    "Record that event happened n more times"
+    if not _enabled:
+        return
+    with _lock:
+        _counters[ event] = _counters.get( event, 0) + n
+
+
+@contextmanager
+def timed( phase, host=None):
+    "Record the time the block takes as phase"
+    if not _enabled:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        add( phase, time.time() - start, host)
+
+
+def _as_dict( table):
+    "A table of phases, ready for JSON"
+    return dict( ( phase, { "count": count, "seconds": round( seconds, 6)})
+                 for phase, ( count, seconds) in table.items())
+
+
+def report():
+    """Return the timings recorded so far, as a dict of phases, podcasts and
+    hosts, each with the count and the total seconds of its phases, and of
+    the event counters"""
+    with _lock:
+        return {
+            "phases": _as_dict( _phases),
+            "podcasts": dict( ( str( castid), _as_dict( table))
+                              for castid, table in _podcasts.items()),
+            "hosts": dict( ( host, _as_dict( table))
+                           for host, table in _hosts.items()),
+            "counters": dict( _counters),
+        }
+
+
+def write_json( path):
+    "Write report() to the named file as JSON"
+    with open( path, 'w') as f:
+        json.dump( report(), f, indent=1, sort_keys=True)
+        f.write( b"\n")
+
+
+def _total( phases):
+    "Seconds of all the phases of a podcast or a host"
+    return sum( entry[ "seconds"] for entry in phases.values())
+
+
+def print_report( file=sys.stderr, top=10):
+    """Print the phase totals, then the podcasts and the hosts that took the
+    longest, at most top of each"""
+    rep = report()
+    print( "\n{0:<16} {1:>6} {2:>10}".format( "Phase", "Count", "Seconds"),
+           file=file)
+    for phase, entry in sorted( rep[ "phases"].items()):
+        print( "{0:<16} {1[count]:>6} {1[seconds]:>10.3f}".format( phase,
+                                                                   entry),
+               file=file)
+    if rep[ "counters"]:
+        print( "\n{0:<18} {1:>6}".format( "Event", "Count"), file=file)
+    for event, n in sorted( rep[ "counters"].items()):
+        print( "{0:<18} {1:>6}".format( event, n), file=file)
+    for title, table in ( ( "Podcast", rep[ "podcasts"]),
+                          ( "Host", rep[ "hosts"])):
+        if not table:
+            continue
+        print( "\n{0:<24} {1:>10}  By phase".format( title, "Seconds"),
+               file=file)
+        slowest = sorted( table.items(), key=lambda kv: -_total( kv[ 1]))
+        for key, phases in slowest[ :top]:
+            detail = ", ".join(
+                "{0} {1:.3f}".format( phase, entry[ "seconds"])
+                for phase, entry in sorted( phases.items()))
+            print( "{0:<24} {1:>10.3f}  {2}".format( key, _total( phases),
+                                                     detail), file=file)
+
+## --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --
+
+def test():
+    "Test code to run when invoked on the command line"
+    print( __doc__)
+    with timed( "ignored"):
+        pass
+    if report()[ "phases"]:
+        raise AssertionError( "Timings were recorded before enable()")
+    enable()
+    with podcast( 1):
+        with timed( "connect", host="example.com"):
+            time.sleep( 0.01)
+        add( "parse", 0.5)
+    with podcast( 2):
+        add( "parse", 0.25)
+    add( "update", 1.0)
+    count( "connection reused", 2)
+    rep = report()
+    print( json.dumps( rep, indent=1, sort_keys=True))
+    print_report( sys.stdout)
+    if rep[ "phases"][ "parse"] != { "count": 2, "seconds": 0.75} or \
+       set( rep[ "podcasts"]) != set( [ "1", "2"]) or \
+       set( rep[ "hosts"][ "example.com"]) != set( [ "connect"]) or \
+       rep[ "counters"] != { "connection reused": 2}:
+        raise AssertionError( "Timings were not aggregated")
+    print( "\n   DONE.")
+
+if __name__ == '__main__':
+    # Run test code when invoked on the command line
+    sys.exit( test())
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026, Robert N. Evans
+
+#
+# PyPod - A podcast media aggregator.  This program is a re-implementation
+# of John Goerzen's no longer supported hpodder utility.
+#
+# PyPod is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPod is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""This file implements bandwidth limiting.  A token bucket is shared by all
+the transfers that it limits, whichever threads they run on."""
+
+# standard library imports
+from __future__ import print_function, unicode_literals
+import sys
+import threading
+import time
+try:
+    str = unicode
+except NameError:
+    pass
+
+# other pypod modules
+from config import get_option
+
+
+__author__    = "Robert N. Evans <http://home.earthlink.net/~n1be/>"
+__copyright__ = "Copyright (C) 2026 {0}. All rights reserved.".format( __author__)
+__date__      = "2026-10-17"
+__license__   = "GPLv3"
+__version__   = "0.1"
+
+
+_min_burst = 64 * 1024 # bytes; at least one chunk of a transfer
+
+
+class TokenBucket( object):
+    """Limit the average rate of transfers to rate bytes per second, with
+    bursts of up to one second's worth.  Each consume() takes its tokens at
+    once, going into debt if need be, then sleeps until the debt is paid;
+    so concurrent callers are served in turn."""
+
+    def __init__( self, rate):
+        self.rate = float( rate)
+        self.burst = max( self.rate, _min_burst)
+        self._tokens = self.burst
+        self._stamp = time.time()
+        self._lock = threading.Lock()
+
+    def consume( self, nbytes):
+        "Account for nbytes transferred; sleep while over the rate limit"
+        with self._lock:
+            now = time.time()
+            self._tokens = min( self.burst, self._tokens +
+                                ( now - self._stamp) * self.rate)
+            self._stamp = now
+            self._tokens -= nbytes
+            wait = -self._tokens / self.rate
+        if wait > 0:
+            time.sleep( wait)
+
+
+def get_limiter( cp, sect, key):
+    """Return a TokenBucket for the rate configured as key in section sect,
+    in KiB per second, or None if that rate is zero (unlimited)"""
+    rate = float( get_option( cp, sect, key) or 0)
+    if rate > 0:
+        return TokenBucket( rate * 1024)
+    return None
+
+## --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --
+
+def test():
+    "Test code to run when invoked on the command line"
+    print( __doc__)
+    print()
+    print( "*** 3 threads share a 256 KiB/s bucket, 640 KiB each")
+    bucket = TokenBucket( 256 * 1024)
+
+    def transfer():
+        for i in range( 20):
+            bucket.consume( 32 * 1024)
+
+    start = time.time()
+    threads = [ threading.Thread( target=transfer) for i in range( 3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    # The first second's worth is a free burst
+    print( ". took {0:.2f} s, expected about 6.5 s".format( elapsed))
+    if not 6.0 < elapsed < 7.5:
+        raise AssertionError( "Rate limit was not honored")
+
+if __name__ == '__main__':
+    # Run test code when invoked on the command line
+    sys.exit( test())
@@ -25,32 +25,27 @@
 
 # standard library imports
 from __future__ import print_function , unicode_literals
+from email.utils import mktime_tz, parsedate_tz
 import hashlib
+import httplib
 import logging
 import os
 import socket
 import sys
-from urlparse import urlparse
+import time
+import urllib
+from urlparse import urljoin, urlparse
+import zlib
 try:
     str = unicode
 except NameError:
     pass
 
-# PyPI module httplib2, not in standard library.
-try:
-    import httplib2
-except ImportError:
-    print( """
-  Error: Module "httplib2" not found. Please install "python-httplib2".
-         If this package is not available for your OS, the httplib2
-         package can be downloaded from the Python Package Index,
-         http://pypi.python.org/pypi/httplib2
-""", file=sys.stderr)
-    sys.exit(1)
-
 # other pypod modules
-from config import get_feed_cache
-from utils import sanitize_filename
+from connpool import ConnectionPool
+from sniff import sniff, sniff_size
+import stats
+from utils import preallocate, sanitize_filename
 
 
 __author__    = "Robert N. Evans <http://home.earthlink.net/~n1be/>"
@@ -62,19 +57,21 @@ __version__   = "0.5.1"
 
 _debug = 0
 _socket_timeout = 120 # seconds
+_chunk_size = 64 * 1024 # bytes held in memory per enclosure transfer
+_max_redirects = 10
+_url_safe = b"/%;:@&=+$,!~*'()" # URL characters that need no escaping
+_meta_suffix = ".msg" # validators of a partial download, for resuming it
+_busy_statuses = ( 429, 503) # Too Many Requests, Service Unavailable
+
+_pool = ConnectionPool() # persistent connections, shared by all threads
 
 if _debug:
-    httplib2.debuglevel = 1
+    httplib.HTTPConnection.debuglevel = 1
 
 
 _headers = {"User-Agent": "PyPod/{0} +{1}".format(
         __version__, "http://home.earthlink.net/~n1be/") }
 
-# httplib2 does not understand unicode cache dirname...
-_http = httplib2.Http( get_feed_cache().encode('ascii','ignore'),
-                       timeout=_socket_timeout)
-_http_no_cache = httplib2.Http( timeout=_socket_timeout)
-
 
 def _d( msg):
     "Print debugging messages"
@@ -85,60 +82,391 @@ def _w( msg):
     logging.warning(  msg)
 
 
-def _common_get_url( http, url):
-    "Common code for resource fetch whether or not cacheing is in use."
-    _d( "get url: " + url)
+def set_pool_limits( max_per_host, idle_timeout):
+    """Keep at most max_per_host idle connections to each server, each for at
+       most idle_timeout seconds"""
+    _pool.max_per_host = max_per_host
+    _pool.idle_timeout = idle_timeout
+
+
+def close_pool():
+    "Close the idle connections, reporting how many connections were reused"
+    _d( "connections opened {0.opened}, reused {0.reused}".format( _pool))
+    _pool.close()
+
+
+def _send( o, path, hdrs):
+    """Send a GET request for path to the server of the parsed URL o, on a
+       pooled connection, and return the response with its body not yet
+       read.  The server may have dropped a reused connection while it was
+       idle; then the request is sent again on another connection."""
+    while True:
+        conn, reused = _pool.get( o.scheme, o.hostname, o.port,
+                                  _socket_timeout)
+        stats.count( "connection reused" if reused else "connection opened")
+        try:
+            if not reused:
+                # Name lookup, TCP and TLS handshakes
+                with stats.timed( "connect", o.hostname):
+                    conn.connect()
+            # Until the response headers arrive
+            with stats.timed( "request", o.hostname):
+                conn.request( b'GET', path, headers=hdrs)
+                response = conn.getresponse()
+        except ( httplib.HTTPException, socket.error) as e:
+            conn.close()
+            if reused and not isinstance( e, socket.timeout):
+                _d( "stale connection: {0!r}".format( e))
+                continue
+            raise
+        response.pool_conn = conn
+        return response
+
+
+def _release( response):
+    """Done with response: put its connection back in the pool if the body
+       has been read, otherwise close it"""
+    _pool.release( response, response.pool_conn)
+
+
+def _discard( response):
+    """Done with response without using its body: read a short body such as
+       that of a redirect or error page so that its connection can be reused,
+       then release it"""
     try:
-        http.follow_all_redirects = True
-        # http.force_exception_to_status_code = True
-        response, content = http.request( url, headers=_headers)
-    except httplib2.HttpLib2Error as e:
-        _w( "{0!s}".format( e))
-        return None, None
-    except ( socket.error, socket.timeout) as e:
-        _w( "Socket error: {0!s} at url {1}".format( e, url))
+        response.read( _chunk_size)
+    except ( httplib.HTTPException, socket.error):
+        pass
+    _release( response)
+
+
+def _open_url( url, headers, allow=()):
+    """Send a GET request for url, following redirects.  Returns the response
+       with its body not yet read, and the URL that finally answered.
+       Error statuses listed in allow are returned to the caller, others
+       fail.  Returns None, None on failure."""
+    hdrs = dict( ( k.encode( 'ascii'), v.encode( 'utf-8'))
+                 for k, v in headers.items())
+    for i in range( _max_redirects + 1):
+        _d( "open url: " + url)
+        o = urlparse( url)
+        if o.scheme not in ( 'http', 'https') or not o.hostname:
+            _w( "Unsupported URL: {0}".format( url))
+            return None, None
+        # Escape any characters in the URL that may not be sent as-is
+        path = urllib.quote( ( o.path or '/').encode( 'utf-8'), _url_safe)
+        if o.query:
+            path += b'?' + urllib.quote( o.query.encode( 'utf-8'),
+                                         _url_safe + b'?')
+        try:
+            response = _send( o, path, hdrs)
+        except httplib.HTTPException as e:
+            _w( "HTTP error: {0!r} at url {1}".format( e, url))
+            return None, None
+        except ( socket.error, socket.timeout) as e:
+            _w( "Socket error: {0!s} at url {1}".format( e, url))
+            return None, None
+        _d( "response: {0.status} {1}".format( response, response.getheaders()))
+        location = response.getheader( 'location')
+        if response.status in ( 301, 302, 303, 307, 308) and location:
+            _discard( response)
+            url = urljoin( url, location.decode( 'utf-8', 'replace'))
+            continue
+        if response.status >= 400 and response.status not in allow:
+            _w( "HTTP error status {0.status} - {0.reason}".format( response))
+            _discard( response)
+            return None, None
+        return response, url
+    _w( "Too many redirects at url {0}".format( url))
+    return None, None
+
+
+def _decode_body( response, body):
+    "Undo the Content-Encoding of a response body"
+    encoding = ( response.getheader( 'content-encoding') or '').lower()
+    if encoding in ( 'gzip', 'x-gzip'):
+        return zlib.decompress( body, 16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        try:
+            return zlib.decompress( body)
+        except zlib.error:
+            # Some servers send raw deflate data without the zlib header
+            return zlib.decompress( body, -zlib.MAX_WBITS)
+    return body
+
+
+def feed_get( url, etag=None, lastmodified=None, limiter=None):
+    """Fetch a resource that is repeatedly referenced, like a podcast feed.
+       The validators saved from the previous fetch, if any, make the request
+       conditional; a 304 (Not Modified) response then has no content.
+       Compressed transfer is requested.  If a limiter is given, the bytes
+       received are charged to it.
+         Returns ( response, content), or None, None on failure.  The ETag
+       and Last-Modified headers of the response are for the next call.
+       A server that is too busy ( 429 or 503) is not a plain failure: its
+       response is returned without content, for retry_after()."""
+    headers = dict( _headers)
+    headers[ 'Accept-Encoding'] = 'gzip, deflate'
+    if etag:
+        headers[ 'If-None-Match'] = etag
+    if lastmodified:
+        headers[ 'If-Modified-Since'] = lastmodified
+    response, final_url = _open_url( url, headers, allow=_busy_statuses)
+    if not response:
         return None, None
-    _d( "response: " + str( response))
-    if response.status >= 400:
+    if response.status in _busy_statuses:
         _w( "HTTP error status {0.status} - {0.reason}".format( response))
+        _discard( response)
+        return response, None
+    chunks = []
+    try:
+        with stats.timed( "transfer", urlparse( final_url).hostname):
+            while True:
+                chunk = response.read( _chunk_size)
+                if not chunk:
+                    break
+                chunks.append( chunk)
+                if limiter:
+                    limiter.consume( len( chunk))
+        content = _decode_body( response, b"".join( chunks))
+    except ( httplib.HTTPException, socket.error, socket.timeout) as e:
+        _w( "Transfer error: {0!r} at url {1}".format( e, url))
+        return None, None
+    except zlib.error as e:
+        _w( "Bad compressed content: {0!s} at url {1}".format( e, url))
         return None, None
+    finally:
+        _release( response)
     return response, content
 
 
-def cached_get( url):
-    """Fetch a resource with caching.  This is intended for resources that are
-       repeatedly referenced like podcast feeds."""
-    return _common_get_url( _http, url)
+def retry_after( response):
+    """Return the seconds to wait before asking again, according to the
+       Retry-After header of response, or None if it has none"""
+    value = response.getheader( 'retry-after')
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int( value)
+    date = parsedate_tz( value)
+    if date is None:
+        _d( "bad Retry-After: {0}".format( value))
+        return None
+    return max( 0, int( mktime_tz( date) - time.time()))
+
+
+def staging_name( url):
+    "Return the name of the file that holds an enclosure while it downloads"
+    return hashlib.md5( url.encode( 'utf-8')).hexdigest()
+
+
+def staging_names( url):
+    """Return the names of all files kept for an enclosure while it downloads:
+       the data file and the file holding the validators used to resume it"""
+    name = staging_name( url)
+    return [ name, name + _meta_suffix]
+
+
+def _read_meta( path):
+    "Return the validators saved with a partial download as a dict"
+    meta = {}
+    try:
+        with open( path + _meta_suffix) as f:
+            for line in f:
+                key, sep, value = line.decode( 'utf-8').partition( ':')
+                if sep:
+                    meta[ key.strip()] = value.strip()
+    except IOError:
+        pass
+    return meta
+
+
+def _write_meta( path, meta):
+    "Save the validators of a download, in case it must be resumed"
+    with open( path + _meta_suffix, 'w') as f:
+        for key, value in sorted( meta.items()):
+            f.write( "{0}: {1}\n".format( key, value).encode( 'utf-8'))
+
+
+def _discard_partial( path):
+    "Remove a partial download and its validators"
+    for p in ( path, path + _meta_suffix):
+        if os.path.exists( p):
+            os.remove( p)
+
+
+def _if_range( meta):
+    """Return the If-Range validator for resuming a partial download, or
+       None.  Weak ETags may not be used with If-Range."""
+    etag = meta.get( 'etag')
+    if etag and not etag.startswith( 'W/'):
+        return etag
+    return meta.get( 'last-modified')
+
+
+def _content_range( response):
+    "Return first byte and total length from a 206 response, or None, None"
+    try:
+        unit, sep, spec = response.getheader( 'content-range').partition( ' ')
+        span, sep, total = spec.partition( '/')
+        first = int( span.partition( '-')[0])
+        return first, ( total != '*' and int( total) or None)
+    except ( AttributeError, ValueError):
+        return None, None
+
+
+def _fresh_transfer( response, final_url, path):
+    """Prepare to download a whole entity.  Its validators are noted right
+       away, so that a transfer that fails midway can be resumed later.
+       Returns ( response, final URL, offset, expected total length)."""
+    try:
+        total = int( response.getheader( 'content-length'))
+    except ( TypeError, ValueError):
+        total = None
+    meta = {}
+    for key in ( 'etag', 'last-modified'):
+        if response.getheader( key):
+            meta[ key] = response.getheader( key).decode( 'utf-8', 'replace')
+    if total is not None:
+        meta[ 'length'] = str( total)
+    if _if_range( meta):
+        _write_meta( path, meta)
+    elif os.path.exists( path + _meta_suffix):
+        os.remove( path + _meta_suffix)
+    return response, final_url, 0, total
+
+
+def _start_transfer( url, path):
+    """Open url for downloading to path.  If an earlier partial download of
+       the same entity is on disk, ask the server for the remainder only.
+       Returns ( response, final URL, offset, expected total length)."""
+    meta = _read_meta( path)
+    validator = _if_range( meta)
+    offset = 0
+    if validator and os.path.exists( path):
+        offset = os.path.getsize( path)
+    if not offset:
+        response, final_url = _open_url( url, _headers)
+        if not response:
+            return None, None, 0, None
+        return _fresh_transfer( response, final_url, path)
+
+    headers = dict( _headers)
+    headers[ 'Range'] = 'bytes={0}-'.format( offset)
+    headers[ 'If-Range'] = validator
+    _d( "resuming at byte {0}: {1}".format( offset, path))
+    response, final_url = _open_url( url, headers, allow=( 416,))
+    if not response:
+        return None, None, 0, None
+    if response.status == 206:
+        first, total = _content_range( response)
+        etag = response.getheader( 'etag')
+        if first == offset and \
+           str( total) == meta.get( 'length', str( total)) and \
+           ( not etag or etag == meta.get( 'etag', etag)):
+            return response, final_url, offset, total
+        _w( "Server sent a different range or entity; restarting {0}"
+            .format( url))
+    elif response.status == 416:
+        _w( "Server refused to resume; restarting {0}".format( url))
+    else:
+        # The entity changed or the server ignores Range; this is all of it
+        _d( "resume declined, status {0.status}".format( response))
+        return _fresh_transfer( response, final_url, path)
+    _discard( response)
+    _discard_partial( path)
+    response, final_url = _open_url( url, _headers)
+    if not response:
+        return None, None, 0, None
+    return _fresh_transfer( response, final_url, path)
 
 
-def easy_get( enc_dir, url):
+def easy_get( enc_dir, url, fsync=False, prealloc=False, progress=None,
+              limiters=()):
     """Fetch a resource to a local file without cacheing.  This is intended for
-       resources like enclosures that typically only are fetched once."""
-    response, content = _common_get_url( _http_no_cache, url)
+       resources like enclosures that typically only are fetched once.
+       The body is streamed to disk in chunks of _chunk_size bytes.  If
+       requested, disk space for the advertised Content-Length is reserved
+       up front and the file is flushed to disk once complete.
+         An interrupted transfer leaves its partial file behind.  The next
+       call resumes it with an HTTP Range request, provided that the server
+       still has the same entity.
+         If given, progress.total and progress.received are kept up to date
+       for the progress meter.  Each chunk received is charged to every one
+       of the limiters, which slows the transfer to the lowest of their
+       rates.
+         Returns ( filename, path, HTTP content type, sniffed type, digest),
+       where the sniffed type is the result of sniff() on the first bytes of
+       the file, captured as they arrive, and digest is the SHA-256 of the
+       file in hex, computed as it is written."""
+    path = enc_dir + os.sep + staging_name( url)
+    response, final_url, offset, total = _start_transfer( url, path)
     if not response:
-        return None, None, None
-    try:
-        _d( "content-location: {0}".format( response['content-location']))
-        o = urlparse( response['content-location'])
-        bef, sep, filename = o.path.rpartition( "/")
-    except:
-        filename = None
+        return None, None, None, None, None
+    location = response.getheader( 'content-location')
+    if location:
+        _d( "content-location: {0}".format( location))
+        final_url = urljoin( final_url, location.decode( 'utf-8', 'replace'))
+    bef, sep, filename = urlparse( final_url).path.rpartition( "/")
     if not filename or filename == "." or filename == "..":
-        filename = hashlib.md5( url).hexdigest()
+        filename = staging_name( url)
     filename = sanitize_filename( filename)
     _d( "filename: " + filename)
-    path = enc_dir + os.sep + hashlib.md5( url).hexdigest()
-    with open( path, 'w') as f:
-        f.write( content)
-    mime_type = response['content-type']
-    _d( "type: " + mime_type)
-    return filename, path, mime_type
+    received = offset
+    head = b""
+    digest = hashlib.sha256()
+    if offset:
+        with open( path, 'rb') as f:
+            head = f.read( sniff_size)
+            f.seek( 0)
+            for chunk in iter( lambda: f.read( _chunk_size), b""):
+                digest.update( chunk)
+    if progress:
+        progress.total = total or progress.total
+        progress.received = received
+    try:
+        with open( path, offset and 'ab' or 'wb') as f, \
+             stats.timed( "transfer", urlparse( final_url).hostname):
+            if prealloc and total:
+                preallocate( f.fileno(), total)
+            while True:
+                chunk = response.read( _chunk_size)
+                if not chunk:
+                    break
+                f.write( chunk)
+                digest.update( chunk)
+                if len( head) < sniff_size:
+                    head += chunk[ :sniff_size - len( head)]
+                received += len( chunk)
+                if progress:
+                    progress.received = received
+                for limiter in limiters:
+                    limiter.consume( len( chunk))
+            if fsync:
+                f.flush()
+                os.fsync( f.fileno())
+    except ( httplib.HTTPException, socket.error, socket.timeout) as e:
+        _w( "Transfer error: {0!r} at url {1}".format( e, url))
+        return None, None, None, None, None
+    finally:
+        _release( response)
+    if total is not None and received != total:
+        _w( "Transfer incomplete: got {0} of {1} bytes at url {2}"
+            .format( received, total, url))
+        return None, None, None, None, None
+    if os.path.exists( path + _meta_suffix):
+        os.remove( path + _meta_suffix)
+    mime_type = response.getheader( 'content-type', '').decode( 'utf-8')
+    sniffed = sniff( head)
+    _d( "type: {0}, sniffed: {1}".format( mime_type, sniffed))
+    return filename, path, mime_type, sniffed, digest.hexdigest()
 
 
 def _test_get( url):
-    r, c = cached_get( url)
+    r, c = feed_get( url)
     if c:
-        print( "cached_get len = {0}".format( len( c)))
+        print( "feed_get len = {0}".format( len( c)))
 
 ## --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  -- 
 
@@ -165,7 +493,8 @@ def test():
         print()
 
         # more rapid timeout for following tests
-        _http = httplib2.Http( get_feed_cache().encode('ascii','ignore'), 5)
+        global _socket_timeout
+        _socket_timeout = 5
 
         url = "http://barf.wildwood/"
         print( "NO SUCH DNS NAME: " + url)
@@ -181,39 +510,39 @@ def test():
 
     if False:
         url = "http://cmdln.evenflow.nl/mp3/cmdln.net_2009-05-20.mp3"
-        f, p, t = easy_get( "/tmp", url)
+        f, p, t, s, h = easy_get( "/tmp", url)
         print( "Result file {0}".format( p))
         print()
 
         url = "http://www.pbs.org/wgbh/nova/rss/podcast/redir/http://www-tc.pbs.org/wgbh/nova/rss/media/nova_a_pod_machupicchu_100127a.mp3"
-        f, p, t = easy_get( "/tmp", url)
+        f, p, t, s, h = easy_get( "/tmp", url)
         print( "Result file {0}".format( p))
         print()
 
         url = "http://downloads.bbc.co.uk/podcasts/radio4/material/material_20100204-1800a.mp3"
-        f, p, t = easy_get( "/tmp", url)
+        f, p, t, s, h = easy_get( "/tmp", url)
         print( "Result file {0}".format( p))
         print()
 
         url = "http://www.pbs.org/wgbh/amex/rss/np/redir/http://www-tc.pbs.org/wgbh/amex/rss/media/presidents_10.mp3"
-        f, p, t = easy_get( "/tmp", url)
+        f, p, t, s, h = easy_get( "/tmp", url)
         print( "Result file {0}".format( p))
         print()
 
         url = "http://www.scientificamerican.com/podcast/podcast.mp3?e_id=9E8EAAE7-E0AA-61B1-B502EB309A28A85D&ref=p_itune"
-        f, p, t = easy_get( "/tmp", url)
+        f, p, t, s, h = easy_get( "/tmp", url)
         print( "Result file {0}".format( p))
         print()
 
     # Invalid URL, server returns success
     url = "http://www.scientificamerican.com/podcast/podcast.mp3?e_id=9F8EAAE7-E0AA-61B1-B502EB309A28A85D&ref=p_itune"
-    f, p, t = easy_get( "/tmp", url)
+    f, p, t, s, h = easy_get( "/tmp", url)
     print( "Result file {0}".format( p))
     print()
 
     # Invalid URL, no such file
     url = "http://www.ibm.com/barf/baz"
-    f, p, t = easy_get( "/tmp", url)
+    f, p, t, s, h = easy_get( "/tmp", url)
     print( "Result file {0}".format( p))
     print()
 
@@ -25,11 +25,15 @@
 # standard library imports
 from __future__ import print_function, unicode_literals
 from contextlib import contextmanager
+import ctypes
+import ctypes.util
+import errno
 import fcntl
 import logging
 import os
 import string
 import sys
+import threading
 try:
     str = unicode
 except NameError:
@@ -57,7 +61,10 @@ def generic_id_help( name=None):
 """You can optionally specify one or more {0}{1}IDs.  If
 given, only those IDs will be selected for processing.
 The special id "all" will select all {0}s.
-If no ID is given, then "all" will be assumed."""
+If no ID is given, then "all" will be assumed.
+An ID may also be a range: 100-250 selects IDs 100 through
+250, 300- selects 300 and up, and -20 selects up to 20.
+Put "--" before the IDs if the first of them starts with "-"."""
     if name:
         spacer = " "
     else:
@@ -127,6 +134,175 @@ def init_dirs():
             os.makedirs( d)
 
 
+def _load_libc():
+    "Return the C library, for calls that the os module does not provide"
+    try:
+        return ctypes.CDLL( ctypes.util.find_library( 'c'), use_errno=True)
+    except OSError:
+        return None
+
+_libc = _load_libc()
+
+
+def preallocate( fd, length):
+    """Reserve disk space for length bytes of an open file, to limit
+fragmentation and to fail early when the disk is full.  The apparent file
+size does not change, so a partial download still shows how much of it has
+arrived.  This is a no-op where Linux fallocate() is not available."""
+    func = getattr( _libc, 'fallocate64', None) or \
+           getattr( _libc, 'fallocate', None)
+    if not func:
+        return
+    FALLOC_FL_KEEP_SIZE = 1
+    if func( fd, FALLOC_FL_KEEP_SIZE,
+             ctypes.c_int64( 0), ctypes.c_int64( length)):
+        # Not supported by this filesystem, or out of space; let write() tell
+        _d( "fallocate: {0}".format( os.strerror( ctypes.get_errno())))
+
+
+def _kernel_copy_funcs():
+    """Return the C library calls that copy between files without passing the
+data through user space, best first; each is called as f( fd_in, fd_out, n)"""
+    funcs = []
+    cfr = getattr( _libc, 'copy_file_range', None)
+    if cfr:
+        cfr.argtypes = [ ctypes.c_int, ctypes.c_void_p, ctypes.c_int,
+                         ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint]
+        cfr.restype = ctypes.c_ssize_t
+        funcs.append( lambda fin, fout, n: cfr( fin, None, fout, None, n, 0))
+    sf = getattr( _libc, 'sendfile64', None) or getattr( _libc, 'sendfile', None)
+    if sf:
+        sf.argtypes = [ ctypes.c_int, ctypes.c_int, ctypes.c_void_p,
+                        ctypes.c_size_t]
+        sf.restype = ctypes.c_ssize_t
+        funcs.append( lambda fin, fout, n: sf( fout, fin, None, n))
+    return funcs
+
+_kernel_copies = _kernel_copy_funcs()
+_copy_chunk = 8 * 1024 * 1024
+
+
+def copy_fd( fin, fout):
+    """Copy the rest of open file fin into open file fout, with
+copy_file_range() or sendfile() where the kernel supports them for these
+files, else by reading and writing."""
+    for func in _kernel_copies:
+        copied = 0
+        while True:
+            n = func( fin, fout, _copy_chunk)
+            if n > 0:
+                copied += n
+            elif n == 0:
+                return
+            else:
+                err = ctypes.get_errno()
+                if copied or err not in ( errno.ENOSYS, errno.EXDEV,
+                                          errno.EINVAL, errno.EOPNOTSUPP):
+                    raise OSError( err, os.strerror( err))
+                _d( "kernel copy unavailable: {0}".format( os.strerror( err)))
+                break
+    while True:
+        buf = os.read( fin, 1024 * 1024)
+        if not buf:
+            return
+        while buf:
+            buf = buf[ os.write( fout, buf):]
+
+
+def claim_name( src, template):
+    """Rename file src to template, or if that name is taken, to the first
+free name of the form <name>-<n>.<ext> in the same directory.  Returns the
+name used.  A hard link claims the name atomically, so that an existing file
+is never replaced; renaming is the fallback where links are not supported."""
+    root, ext = os.path.splitext( template)
+    n = 0
+    while True:
+        name = n and "{0}-{1}{2}".format( root, n, ext) or template
+        n += 1
+        try:
+            os.link( src, name)
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                continue
+            if e.errno not in ( errno.EPERM, errno.EOPNOTSUPP, errno.EMLINK):
+                raise
+            if os.path.lexists( name):
+                continue
+            os.rename( src, name)
+            return name
+        os.unlink( src)
+        return name
+
+
+FICLONE = 0x40049409   # From linux/fs.h
+
+def link_or_clone( src, dst, hardlink=False):
+    """Create file dst sharing the disk blocks of file src: a copy-on-write
+clone (reflink) where the filesystem supports that, else a hard link if
+allowed.  A hard link is only safe if neither file is ever changed in place.
+dst must not exist.  Returns "reflink" or "hardlink", or None if neither
+could be made, e.g. across filesystems."""
+    fin = os.open( src, os.O_RDONLY)
+    try:
+        fout = os.open( dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0666)
+        try:
+            fcntl.ioctl( fout, FICLONE, fin)
+            return "reflink"
+        except IOError as e:
+            _d( "reflink {0}: {1}".format( dst, e))
+            os.remove( dst)
+        finally:
+            os.close( fout)
+    finally:
+        os.close( fin)
+    if hardlink:
+        try:
+            os.link( src, dst)
+            return "hardlink"
+        except OSError as e:
+            _d( "link {0}: {1}".format( dst, e))
+    return None
+
+
+def copy_file( src, dst, fsync=False):
+    "Copy file src to dst, which must not exist; see copy_fd()"
+    fin = os.open( src, os.O_RDONLY)
+    try:
+        fout = os.open( dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0666)
+        try:
+            copy_fd( fin, fout)
+            if fsync:
+                os.fsync( fout)
+        finally:
+            os.close( fout)
+    finally:
+        os.close( fin)
+
+
+def place_file( src, dst, fsync=False):
+    """Move finished file src to dst, creating directories as needed and
+never overwriting an existing file (see claim_name).  Returns the final name.
+  On the same filesystem this is a rename.  Otherwise the data are copied in
+the kernel to a .partial file next to dst first, so that a final name only
+ever refers to a complete file.  The .partial name is unique to this process
+and thread, as other threads may be placing files with the same name."""
+    dir = os.path.dirname( dst)
+    os.path.isdir( dir) or os.makedirs( dir)
+    if os.stat( src).st_dev == os.stat( dir).st_dev:
+        return claim_name( src, dst)
+    partial = "{0}.{1}-{2}.partial".format( dst, os.getpid(),
+                                           threading.current_thread().ident)
+    try:
+        copy_file( src, partial, fsync)
+        final = claim_name( partial, dst)
+    except:
+        if os.path.exists( partial):
+            os.remove( partial)
+        raise
+    os.remove( src)
+    return final
+
+
 def empty_dir( path):
     "Delete files in a given directory, but not the directory itself"
     for root, dirs, files in os.walk( path, topdown=False):
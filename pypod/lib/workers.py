@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026, Robert N. Evans
+
+#
+# PyPod - A podcast media aggregator.  This program is a re-implementation
+# of John Goerzen's no longer supported hpodder utility.
+#
+# PyPod is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPod is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""This file implements a pool of worker threads.  Jobs run on the worker
+threads, but their results are handed back to the thread that owns the pool.
+That owning thread is the only one that may touch the database."""
+
+# standard library imports
+from __future__ import print_function, unicode_literals
+import logging
+import Queue
+import sys
+import threading
+import time
+try:
+    str = unicode
+except NameError:
+    pass
+
+
+__author__    = "Robert N. Evans <http://home.earthlink.net/~n1be/>"
+__copyright__ = "Copyright (C) 2026 {0}. All rights reserved.".format( __author__)
+__date__      = "2026-10-17"
+__license__   = "GPLv3"
+__version__   = "0.1"
+
+
+def _d( msg):
+    "Print debugging messages"
+    logging.debug( "workers: " + str( msg))
+
+
+class _Job( object):
+    """One unit of work submitted to a WorkerPool"""
+
+    def __init__( self, func, args, limits, tag):
+        self.func = func
+        self.args = args
+        self.limits = limits
+        self.tag = tag
+
+
+class WorkerPool( object):
+    """Run submitted jobs on at most nthreads worker threads.
+    A job may name (key, limit) pairs -- no more than limit jobs sharing
+    one key are run at the same time, e.g. to cap the number of concurrent
+    transfers from a single host.  Jobs that are held back by a limit do not
+    block later jobs with different keys.
+      Several pools may share one results queue, see completed()."""
+
+    def __init__( self, nthreads, results=None):
+        self.nthreads = max( 1, nthreads)
+        self.results = results or Queue.Queue()
+        self.outstanding = 0      # Submitted, but result not yet collected
+        self._cv = threading.Condition()
+        self._pending = []        # Jobs not yet started, in submission order
+        self._running = {}        # key -> number of running jobs
+        self._threads = []
+        self._closed = False
+
+    def submit( self, func, args=(), limits=(), tag=None):
+        """Queue func( *args) to run on a worker thread.  The result is
+        reported by completed() together with tag.  Each limit must be at
+        least 1, or the job could never run."""
+        for key, limit in limits:
+            if limit < 1:
+                raise ValueError( "Limit {0} for {1!r} is less than 1"
+                                  .format( limit, key))
+        job = _Job( func, args, limits, tag)
+        with self._cv:
+            if self._closed:
+                raise ValueError( "Can not submit jobs to a closed pool")
+            self._pending.append( job)
+            self._cv.notify()
+            if len( self._threads) < self.nthreads:
+                t = threading.Thread( target=self._run,
+                        name="worker-{0}".format( len( self._threads)))
+                t.daemon = True   # Do not hold up exit on Ctrl-C
+                self._threads.append( t)
+                t.start()
+        self.outstanding += 1
+        return job
+
+    def close( self):
+        "Let worker threads exit once no more jobs are pending"
+        with self._cv:
+            self._closed = True
+            self._cv.notify_all()
+
+    def shutdown( self):
+        "Discard jobs that have not started; return the discarded jobs"
+        with self._cv:
+            dropped = self._pending
+            self._pending = []
+            self._closed = True
+            self._cv.notify_all()
+        self.outstanding -= len( dropped)
+        return dropped
+
+    def join( self):
+        """Wait for the worker threads to exit; call close() or shutdown()
+        first.  The wait can not be interrupted by Ctrl-C, so do not join
+        a pool whose jobs may still be running after an interrupt."""
+        for t in self._threads:
+            t.join()
+
+    def _next_job( self):
+        "Remove and return the first pending job allowed to run, or None"
+        for i, job in enumerate( self._pending):
+            for key, limit in job.limits:
+                if self._running.get( key, 0) >= limit:
+                    break
+            else:
+                del self._pending[ i]
+                for key, limit in job.limits:
+                    self._running[ key] = self._running.get( key, 0) + 1
+                return job
+        return None
+
+    def _run( self):
+        "Worker thread main loop"
+        while True:
+            with self._cv:
+                job = self._next_job()
+                while job is None:
+                    if self._closed and not self._pending:
+                        return
+                    self._cv.wait()
+                    job = self._next_job()
+            try:
+                result, exc = job.func( *job.args), None
+            except Exception:
+                result, exc = None, sys.exc_info()
+            with self._cv:
+                for key, limit in job.limits:
+                    self._running[ key] -= 1
+                self._cv.notify_all()
+            self.results.put( ( self, job, result, exc))
+
+
+def completed( *pools):
+    """Yield ( job, result, exc_info) for each job as it finishes, until
+    every given pool has no outstanding jobs.  All pools must share one
+    results queue.  Run this in the thread that owns the pools; jobs may be
+    submitted to any of the pools while iterating."""
+    results = pools[0].results
+    while any( p.outstanding for p in pools):
+        try:
+            # A timeout keeps the wait interruptible by Ctrl-C
+            pool, job, result, exc = results.get( True, 1)
+        except Queue.Empty:
+            continue
+        pool.outstanding -= 1
+        yield job, result, exc
+
+## --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --  --
+
+def test():
+    "Test code to run when invoked on the command line"
+    print( __doc__)
+    print()
+    logging.basicConfig( level=logging.DEBUG,
+                         format="%(levelname)s %(message)s")
+    lock = threading.Lock()
+    active = {}
+    peak = {}
+
+    def job( n, key):
+        with lock:
+            active[ key] = active.get( key, 0) + 1
+            peak[ key] = max( peak.get( key, 0), active[ key])
+        time.sleep( 0.05)
+        with lock:
+            active[ key] -= 1
+        if n == 7:
+            raise ValueError( "job 7 fails")
+        return n * n
+
+    print( "*** 12 jobs on 4 threads, at most 1 'a' and 2 'b' at a time")
+    pool = WorkerPool( 4)
+    for n in range( 12):
+        key = "ab"[ n % 2]
+        pool.submit( job, ( n, key), limits=[ ( key, key == "a" and 1 or 2)],
+                     tag=n)
+    got = []
+    for j, result, exc in completed( pool):
+        if exc:
+            print( ". job {0} raised {1!r}".format( j.tag, exc[1]))
+        else:
+            got.append( result)
+    pool.close()
+    pool.join()
+    print( ". results: {0}".format( sorted( got)))
+    print( ". peak concurrency per key: {0}".format( sorted( peak.items())))
+    if peak[ "a"] != 1 or peak[ "b"] > 2 or len( got) != 11:
+        raise AssertionError( "Concurrency limits were not honored")
+
+    print( "\n*** a limit below 1 is refused")
+    try:
+        WorkerPool( 1).submit( job, ( 0, "d"), limits=[ ( "d", 0)])
+    except ValueError as e:
+        print( ". {0}".format( e))
+    else:
+        raise AssertionError( "A limit of 0 was accepted")
+
+    print( "\n*** shutdown discards jobs that have not started")
+    pool = WorkerPool( 1)
+    for n in range( 5):
+        pool.submit( job, ( n, "c"), tag=n)
+    dropped = pool.shutdown()
+    print( ". dropped {0} jobs".format( len( dropped)))
+    for j, result, exc in completed( pool):
+        print( ". job {0} still finished".format( j.tag))
+    pool.join()
+    print( "\n   DONE.")
+
+if __name__ == '__main__':
+    # Run test code when invoked on the command line
+    sys.exit( test())
@@ -35,8 +35,12 @@ except NameError:
 
 # other pypod modules
 from commands import implemented_commands
-from lib.config import load_config
+from lib.config import get_option, load_config
+from lib.datatypes import set_validation
 from lib.db import connect, disconnect
+from lib.schedule import parse_duration
+from lib import stats
+from lib.url_getter import close_pool, set_pool_limits
 from lib.utils import exe_name, init_dirs
 
 
@@ -66,6 +70,11 @@ def main( argv=None):
                        help="Show this help message and exit.")
     parser.add_option( "-d", "--debug", dest="debug", action="store_true",
                        default=False, help="Enable debugging printouts.")
+    parser.add_option( "--stats", dest="stats", action="store_true",
+                       default=False,
+                       help="Report where the time went at the end of the run.")
+    parser.add_option( "--stats-json", dest="stats_json", metavar="FILE",
+                       help="Write the timings of the run to FILE as JSON.")
     parser.disable_interspersed_args() # Stop parsing at cmd verb
     (optargs, command_args) = parser.parse_args()
     if _debug:
@@ -77,6 +86,8 @@ def main( argv=None):
     else:
         logging.basicConfig( level=logging.INFO,
                              format="%(levelname)s %(message)s")
+        # Type checks of podcast and episode members are for debugging
+        set_validation( False)
 
     if len( command_args) == 0:
         command_name = "fetch"    # 'fetch all' is the default command
@@ -88,11 +99,25 @@ def main( argv=None):
         raise ValueError(
             "Unsupported command: {0}\n{1}".format( command_name, usage_help))
 
+    if optargs.stats or optargs.stats_json:
+        stats.enable()
     init_dirs()
     cp=load_config()
+    # Idle connections kept per server, for reuse by later requests
+    set_pool_limits(
+        int( get_option( cp, "general", "maxhostthreads")),
+        parse_duration( get_option( cp, "general", "keepalivetime")))
     dbh=connect()
-    cmd( args=command_args, gcp=cp, gdbh=dbh)
-    disconnect( dbh)
+    try:
+        with stats.timed( "run"):
+            cmd( args=command_args, gcp=cp, gdbh=dbh)
+    finally:
+        close_pool()
+        disconnect( dbh)
+        if optargs.stats:
+            stats.print_report()
+        if optargs.stats_json:
+            stats.write_json( optargs.stats_json)
 
 
 if __name__ == "__main__":